@@ -19,6 +19,7 @@ DEFAULT_CONFIG = {
     "max_scale_factor": 0.9,      # МАКС масштаб
     "min_scale_factor": 0.1,      # МИН маштаб
     "margin_factor": 0.98,        # Отсупы
+    "max_processing_size": 1024,  # Макс. сторона изображения при обработке (в пикселях)
 
     # === ПАРАМЕТРЫ ШТРИХОВКИ ===
     "hatch_density": 12,          # Плотность штриховки (количество линий)
@@ -1,11 +1,13 @@
-import datetime
-import math
+import io
 import numpy as np
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, TextIO
 from abc import ABC, abstractmethod
-from utils import transform_coordinates, calculate_safe_z, validate_numeric_input
+from utils import transform_coordinates_batch, calculate_safe_z, validate_numeric_input
 from config import DEFAULT_CONFIG
 
+KDTREE_MIN_POINTS = 64
+NEAR_THRESHOLD_MM = 2.0
+
 
 class OptimizationStrategy(ABC):
     
@@ -14,42 +16,85 @@ class OptimizationStrategy(ABC):
         pass
     
     @abstractmethod
-    def _extract_points(self, items: List[Any]) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+    def _extract_points(self, items: List[Any]) -> Tuple[np.ndarray, np.ndarray]:
         pass
     
-    def _greedy_sort(self, points: List[Tuple[Tuple[float, float], Tuple[float, float]]]) -> List[int]:
-        n = len(points)
+    def _greedy_sort(self, starts: np.ndarray, ends: np.ndarray,
+                     allow_reverse: bool = False, near_radius: float = 0.0) -> List[Tuple[int, bool]]:
+        n = len(starts)
         if n <= 1:
-            return list(range(n))
+            return [(i, False) for i in range(n)]
+        
+        if allow_reverse:
+            entries = np.empty((2 * n, 2), dtype=np.float64)
+            entries[0::2] = starts
+            entries[1::2] = ends
+            exits = np.empty_like(entries)
+            exits[0::2] = ends
+            exits[1::2] = starts
+            owner = np.repeat(np.arange(n), 2)
+            flipped = np.tile([False, True], n)
+        else:
+            entries, exits = starts, ends
+            owner = np.arange(n)
+            flipped = np.zeros(n, dtype=bool)
         
-        visited = [False] * n
-        order = [0]
+        entries_per_item = len(entries) // n
+        visited = np.zeros(n, dtype=bool)
+        order = [(0, False)]
         visited[0] = True
+        last_end = ends[0]
+        
+        tree_indices = np.arange(len(entries))
+        tree = None
+        if len(entries) > KDTREE_MIN_POINTS:
+            # scipy загружается только при первой оптимизации большого набора
+            from scipy.spatial import cKDTree
+            tree = cKDTree(entries)
+        stale = entries_per_item
         
         for _ in range(1, n):
-            last_idx = order[-1]
-            last_end = points[last_idx][1]
+            candidates = ()
             
-            min_dist = float('inf')
-            next_idx = -1
-            
-            for i in range(n):
-                if not visited[i]:
-                    start = points[i][0]
-                    dist = math.hypot(last_end[0] - start[0], last_end[1] - start[1])
-                    if dist < min_dist:
-                        min_dist = dist
-                        next_idx = i
+            if tree is not None:
+                tree_size = len(tree_indices)
+                k = min(16, tree_size)
+                
+                if near_radius > 0:
+                    nearby = tree.query_ball_point(last_end, r=near_radius)
+                    if nearby:
+                        candidates = tree_indices[nearby]
+                        candidates = candidates[~visited[owner[candidates]]]
+                
+                while not len(candidates):
+                    _, idxs = tree.query(last_end, k=k)
+                    candidates = tree_indices[np.atleast_1d(idxs)]
+                    candidates = candidates[~visited[owner[candidates]]]
+                    if k == tree_size:
+                        break
+                    k = min(k * 2, tree_size)
             
-            if next_idx != -1:
-                order.append(next_idx)
-                visited[next_idx] = True
+            if len(candidates):
+                entry = int(candidates[0])
             else:
-                for i in range(n):
-                    if not visited[i]:
-                        order.append(i)
-                        visited[i] = True
-                        break
+                diff = entries - last_end
+                dist_sq = np.einsum('ij,ij->i', diff, diff)
+                dist_sq[visited[owner]] = np.inf
+                entry = int(np.argmin(dist_sq))
+            
+            next_idx = int(owner[entry])
+            order.append((next_idx, bool(flipped[entry])))
+            visited[next_idx] = True
+            last_end = exits[entry]
+            stale += entries_per_item
+            
+            if tree is not None and stale * 2 > tree_size:
+                tree_indices = np.flatnonzero(~visited[owner])
+                if len(tree_indices) > KDTREE_MIN_POINTS:
+                    tree = cKDTree(entries[tree_indices])
+                    stale = 0
+                else:
+                    tree = None
         
         return order
 
@@ -59,20 +104,13 @@ class ContourOptimization(OptimizationStrategy):
     def optimize(self, contours: List[np.ndarray], scale_factor: float = 1.0) -> List[np.ndarray]:
         if len(contours) <= 1:
             return contours
-        points = self._extract_points(contours)
-        if not points:
-            return contours
-        optimized_indices = self._greedy_sort(points)
-        return [contours[i] for i in optimized_indices]
+        order = self._greedy_sort(*self._extract_points(contours),
+                                  near_radius=NEAR_THRESHOLD_MM / scale_factor)
+        return [contours[i] for i, _ in order]
     
-    def _extract_points(self, contours: List[np.ndarray]) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
-        points = []
-        for contour in contours:
-            if len(contour) >= 2:
-                start = (float(contour[0][0][0]), float(contour[0][0][1]))
-                end = (float(contour[-1][0][0]), float(contour[-1][0][1]))
-                points.append((start, end))
-        return points
+    def _extract_points(self, contours: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        endpoints = np.asarray([c[[0, -1], 0] for c in contours], dtype=np.float64)
+        return endpoints[:, 0], endpoints[:, 1]
 
 
 class HatchingOptimization(OptimizationStrategy):
@@ -80,33 +118,44 @@ class HatchingOptimization(OptimizationStrategy):
     def optimize(self, lines: List[List[Tuple[float, float]]], scale_factor: float = 1.0) -> List[List[Tuple[float, float]]]:
         if len(lines) <= 1:
             return lines
-        points = self._extract_points(lines)
-        if not points:
-            return lines
-        optimized_indices = self._greedy_sort(points)
-        return [lines[i] for i in optimized_indices]
+        order = self._greedy_sort(*self._extract_points(lines), allow_reverse=True,
+                                  near_radius=NEAR_THRESHOLD_MM / scale_factor)
+        if isinstance(lines, np.ndarray):
+            ordered = lines[[i for i, _ in order]]
+            reverse = np.fromiter((reverse for _, reverse in order), dtype=bool, count=len(order))
+            ordered[reverse] = ordered[reverse, ::-1]
+            return ordered
+        return [lines[i][::-1] if reverse else lines[i] for i, reverse in order]
     
-    def _extract_points(self, lines: List[List[Tuple[float, float]]]) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
-        points = []
-        for line in lines:
-            if len(line) >= 2:
-                start = (float(line[0][0]), float(line[0][1]))
-                end = (float(line[-1][0]), float(line[-1][1]))
-                points.append((start, end))
-        return points
+    def _extract_points(self, lines: List[List[Tuple[float, float]]]) -> Tuple[np.ndarray, np.ndarray]:
+        if isinstance(lines, np.ndarray):
+            return lines[:, 0].astype(np.float64), lines[:, -1].astype(np.float64)
+        endpoints = np.asarray([(line[0], line[-1]) for line in lines], dtype=np.float64)
+        return endpoints[:, 0], endpoints[:, 1]
+
+
+_CONTOUR_OPTIMIZER = ContourOptimization()
+_HATCHING_OPTIMIZER = HatchingOptimization()
 
 
 class GCodeBuilder:
     
-    def __init__(self):
-        self.lines = []
+    _FMT_G0 = "G0 X{:.2f} Y{:.2f}".format
+    _FMT_G0_Z = "G0 X{:.2f} Y{:.2f} Z{:.2f}".format
+    _FMT_G1 = "G1 X{:.2f} Y{:.2f} F{}".format
+    _FMT_G1_Z = "G1 X{:.2f} Y{:.2f} Z{:.2f} F{}".format
+    
+    def __init__(self, out: Optional[TextIO] = None):
+        self._owns_buf = out is None
+        self._buf = io.StringIO() if out is None else out
         self.indent = ""
+        self._last_move = None
     
     def add_line(self, line: str):
         if line.strip():
-            self.lines.append(f"{self.indent}{line}")
-        else:
-            self.lines.append("")
+            self._buf.write(self.indent)
+            self._buf.write(line)
+        self._buf.write("\n")
     
     def add_comment(self, comment: str):
         self.add_line(f"; {comment}")
@@ -120,40 +169,68 @@ class GCodeBuilder:
     
     def add_movement(self, x: float, y: float, z: Optional[float] = None, 
                     feed_rate: int = 0, comment: str = ""):
-        cmd_parts = ["G0" if feed_rate == 0 else "G1"]
-        
+        self._last_move = None
         x = max(0.0, min(x, 1000.0))  
         y = max(0.0, min(y, 1000.0))
         
-        cmd_parts.append(f"X{x:.2f}")
-        cmd_parts.append(f"Y{y:.2f}")
-        
         if z is not None:
             z = max(-20.0, min(z, 50.0))
-            cmd_parts.append(f"Z{z:.2f}")
-        
-        if feed_rate > 0:
-            cmd_parts.append(f"F{feed_rate}")
+            if feed_rate > 0:
+                cmd = self._FMT_G1_Z(x, y, z, feed_rate)
+            else:
+                cmd = self._FMT_G0_Z(x, y, z)
+        elif feed_rate > 0:
+            cmd = self._FMT_G1(x, y, feed_rate)
+        else:
+            cmd = self._FMT_G0(x, y)
         
-        cmd = " ".join(cmd_parts)
+        self._buf.write(self.indent)
+        self._buf.write(cmd)
         if comment:
-            cmd += f" ; {comment}"
+            self._buf.write(" ; ")
+            self._buf.write(comment)
+        self._buf.write("\n")
+    
+    def add_feed_moves(self, points: np.ndarray, feed_rate: int):
+        if not len(points):
+            return
         
-        self.add_line(cmd)
+        points = np.clip(points, 0.0, 1000.0)
+        quantized = np.rint(points * 100.0).astype(np.int64)
+        keep = np.empty(len(points), dtype=bool)
+        keep[0] = self._last_move != (int(quantized[0, 0]), int(quantized[0, 1]), feed_rate)
+        keep[1:] = np.any(quantized[1:] != quantized[:-1], axis=1)
+        self._last_move = (int(quantized[-1, 0]), int(quantized[-1, 1]), feed_rate)
+        
+        write = self._buf.write
+        fmt = self._FMT_G1
+        indent = self.indent
+        
+        for x, y in points[keep].tolist():
+            write(indent)
+            write(fmt(x, y, feed_rate))
+            write("\n")
     
-    def get_gcode(self) -> str:
-        return "\n".join(self.lines)
+    def get_gcode(self) -> Optional[str]:
+        return self._buf.getvalue() if self._owns_buf else None
 
 
 class GCodeGenerator:
     
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], out: Optional[TextIO] = None):
         self.config = self._validate_config(config)
         self.safe_z = calculate_safe_z(self.config["pen_up_z"])
-        self.builder = GCodeBuilder()
+        # Значения, нужные на каждой линии, читаются из словаря один раз
+        self.feed_rate = self.config["feed_rate"]
+        self.rapid_feed_rate = self.config["rapid_feed_rate"]
+        self.pen_down_z = self.config["pen_down_z"]
+        self.hatch_depth = self.config["hatch_depth"]
+        self.builder = GCodeBuilder(out)
     
     def _validate_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
         validated = {}
+        defaults = DEFAULT_CONFIG
+        validate = validate_numeric_input
         
         numeric_params = {
             "scale_factor": (0.01, 1.0),
@@ -167,27 +244,27 @@ class GCodeGenerator:
         }
         
         for param, (min_val, max_val) in numeric_params.items():
-            validated[param] = validate_numeric_input(
-                config.get(param, DEFAULT_CONFIG[param]),
+            validated[param] = validate(
+                config.get(param, defaults[param]),
                 min_val, max_val
             )
         
         boolean_params = ["draw_contours", "draw_hatching", "optimize_order"]
         for param in boolean_params:
-            validated[param] = config.get(param, DEFAULT_CONFIG[param])
+            validated[param] = config.get(param, defaults[param])
         
         return validated
     
     def generate(self, hatching_lines: List[List[Tuple[float, float]]], 
                 contours: List[np.ndarray],
                 image_width: int,
-                image_height: int) -> str:
+                image_height: int) -> Optional[str]:
         self._add_header(image_width, image_height)
         
         if self.config["draw_contours"] and contours:
             self._add_contours(contours, image_width, image_height)
         
-        if self.config["draw_hatching"] and hatching_lines:
+        if self.config["draw_hatching"] and len(hatching_lines):
             self._add_hatching(hatching_lines, image_width, image_height)
         
         self._add_footer()
@@ -208,118 +285,105 @@ class GCodeGenerator:
         self.builder.add_section_header("КОНТУРЫ")
         
         if self.config["optimize_order"] and len(contours) > 1:
-            optimizer = ContourOptimization()
-            contours = optimizer.optimize(contours)
+            contours = _CONTOUR_OPTIMIZER.optimize(contours, self.config["scale_factor"])
         
-        for i, contour in enumerate(contours):
-            if len(contour) < 3:
+        transformed = self._transform_polylines(contours, image_width, image_height)
+        for i, points in enumerate(transformed):
+            if len(points) < 3:
                 continue
             
-            self.builder.add_comment(f"Контур #{i+1}, точек: {len(contour)}")
-            self._process_contour(contour, image_width, image_height)
+            self.builder.add_comment(f"Контур #{i+1}, точек: {len(points)}")
+            self._process_contour(points)
             self.builder.add_line("")
     
-    def _process_contour(self, contour: np.ndarray, image_width: int, image_height: int):
-        first_point = contour[0][0]
-        x_mm, y_mm = transform_coordinates(
-            first_point[0], first_point[1],
-            image_width, image_height,
-            self.config["scale_factor"],
-            self.config["work_area_x"],
-            self.config["work_area_y"]
-        )
-        
-        self.builder.add_movement(x_mm, y_mm, feed_rate=self.config["rapid_feed_rate"],
-                                comment="Быстрое перемещение к началу контура")
-        self.builder.add_movement(x_mm, y_mm, self.config["pen_down_z"], 
-                                feed_rate=self.config["feed_rate"] // 2,
-                                comment="Опускание пера")
-        
-        last_x, last_y = x_mm, y_mm
-        min_dist = 0.3
-        
-        for j in range(1, len(contour)):
-            point = contour[j][0]
-            x_mm, y_mm = transform_coordinates(
-                point[0], point[1],
-                image_width, image_height,
-                self.config["scale_factor"],
-                self.config["work_area_x"],
-                self.config["work_area_y"]
-            )
-            
-            if math.hypot(x_mm - last_x, y_mm - last_y) > min_dist:
-                self.builder.add_movement(x_mm, y_mm, feed_rate=self.config["feed_rate"])
-                last_x, last_y = x_mm, y_mm
-        
-        if len(contour) > 2:
-            x_mm, y_mm = transform_coordinates(
-                first_point[0], first_point[1],
-                image_width, image_height,
-                self.config["scale_factor"],
-                self.config["work_area_x"],
-                self.config["work_area_y"]
-            )
-            if math.hypot(x_mm - last_x, y_mm - last_y) > min_dist:
-                self.builder.add_movement(x_mm, y_mm, feed_rate=self.config["feed_rate"])
-        
-        self.builder.add_movement(x_mm, y_mm, self.safe_z, 
-                                feed_rate=self.config["rapid_feed_rate"],
-                                comment="Подъем пера после контура")
+    def _process_contour(self, points: np.ndarray):
+        self._emit_polyline(points, self.pen_down_z, 0.3, True,
+                            "Быстрое перемещение к началу контура",
+                            "Опускание пера",
+                            "Подъем пера после контура")
     
     def _add_hatching(self, lines: List[List[Tuple[float, float]]], 
                      image_width: int, image_height: int):
         self.builder.add_section_header("ШТРИХОВКА")
         
         if self.config["optimize_order"] and len(lines) > 1:
-            optimizer = HatchingOptimization()
-            lines = optimizer.optimize(lines, self.config["scale_factor"])
+            lines = _HATCHING_OPTIMIZER.optimize(lines, self.config["scale_factor"])
         
-        for i, line in enumerate(lines):
-            if len(line) < 2:
+        transformed = self._transform_polylines(lines, image_width, image_height)
+        for i, points in enumerate(transformed):
+            if len(points) < 2:
                 continue
             
-            self.builder.add_comment(f"Линия штриховки #{i+1}, точек: {len(line)}")
-            self._process_hatching_line(line, image_width, image_height)
+            self.builder.add_comment(f"Линия штриховки #{i+1}, точек: {len(points)}")
+            self._process_hatching_line(points)
             self.builder.add_line("")
     
-    def _process_hatching_line(self, line: List[Tuple[float, float]], 
-                             image_width: int, image_height: int):
-        start_x, start_y = line[0]
-        x_mm, y_mm = transform_coordinates(
-            start_x, start_y,
+    def _process_hatching_line(self, points: np.ndarray):
+        self._emit_polyline(points, self.hatch_depth, 0.2, False,
+                            "Быстрое перемещение к началу линии",
+                            "Опускание пера для штриховки",
+                            "Подъем пера после штриховки")
+    
+    def _transform_polylines(self, polylines: List[Any], image_width: int, image_height: int) -> List[np.ndarray]:
+        if not len(polylines):
+            return []
+        
+        # Все точки переводятся в миллиметры одним векторным вызовом
+        if isinstance(polylines, np.ndarray):
+            points = polylines.reshape(-1, 2).astype(np.float64)
+        else:
+            lengths = [len(polyline) for polyline in polylines]
+            points = np.concatenate([np.asarray(polyline, dtype=np.float64).reshape(-1, 2) for polyline in polylines])
+        points = transform_coordinates_batch(
+            points,
             image_width, image_height,
             self.config["scale_factor"],
             self.config["work_area_x"],
             self.config["work_area_y"]
         )
+        if isinstance(polylines, np.ndarray):
+            return points.reshape(polylines.shape)
+        return np.split(points, np.cumsum(lengths[:-1]))
+    
+    def _emit_polyline(self, points: np.ndarray, pen_z: float, min_dist: float, close: bool,
+                       approach_comment: str, down_comment: str, up_comment: str):
+        feed = self.feed_rate
+        rapid = self.rapid_feed_rate
+        add_mv = self.builder.add_movement
         
-        self.builder.add_movement(x_mm, y_mm, feed_rate=self.config["rapid_feed_rate"],
-                                comment="Быстрое перемещение к началу линии")
-        self.builder.add_movement(x_mm, y_mm, self.config["hatch_depth"], 
-                                feed_rate=self.config["feed_rate"] // 2,
-                                comment="Опускание пера для штриховки")
+        x_mm, y_mm = points[0].tolist()
+        add_mv(x_mm, y_mm, feed_rate=rapid, comment=approach_comment)
+        add_mv(x_mm, y_mm, pen_z, feed_rate=feed // 2, comment=down_comment)
         
-        last_x, last_y = x_mm, y_mm
-        min_dist = 0.2
+        kept = points[self._decimate_indices(points, min_dist)]
         
-        for j in range(1, len(line)):
-            x, y = line[j]
-            x_mm, y_mm = transform_coordinates(
-                x, y,
-                image_width, image_height,
-                self.config["scale_factor"],
-                self.config["work_area_x"],
-                self.config["work_area_y"]
-            )
-            
-            if math.hypot(x_mm - last_x, y_mm - last_y) > min_dist:
-                self.builder.add_movement(x_mm, y_mm, feed_rate=self.config["feed_rate"])
-                last_x, last_y = x_mm, y_mm
+        if close and len(points) > 2:
+            gap = points[0] - (kept[-1] if len(kept) else points[0])
+            if gap @ gap > min_dist * min_dist:
+                kept = np.vstack((kept, points[:1]))
+            end = points[0]
+        else:
+            end = points[-1]
+        
+        self.builder.add_feed_moves(kept, feed)
         
-        self.builder.add_movement(x_mm, y_mm, self.safe_z, 
-                                feed_rate=self.config["rapid_feed_rate"],
-                                comment="Подъем пера после штриховки")
+        x_mm, y_mm = end.tolist()
+        add_mv(x_mm, y_mm, self.safe_z, feed_rate=rapid, comment=up_comment)
+    
+    @staticmethod
+    def _decimate_indices(points: np.ndarray, min_dist: float) -> np.ndarray:
+        if len(points) < 2:
+            return np.empty(0, dtype=np.intp)
+        
+        diffs = np.diff(points, axis=0)
+        cum = np.cumsum(np.sqrt(np.einsum('ij,ij->i', diffs, diffs)))
+        if cum[-1] <= min_dist:
+            return np.empty(0, dtype=np.intp)
+        
+        # arange с дробным шагом может выдать последнее значение, равное cum[-1]
+        targets = np.arange(min_dist, cum[-1], min_dist)
+        indices = np.searchsorted(cum, targets, side='right') + 1
+        return np.unique(np.minimum(indices, len(points) - 1))
     
     def _add_footer(self):
         self.builder.add_section_header("ЗАВЕРШЕНИЕ ПРОГРАММЫ")
@@ -339,10 +403,43 @@ def generate_sketch_gcode(
     image_width: int,
     image_height: int,
     config: dict,
-    optimize_order: bool = True
-) -> str:
+    optimize_order: bool = True,
+    out: Optional[TextIO] = None
+) -> Optional[str]:
     config = config.copy()
     config["optimize_order"] = optimize_order
     
-    generator = GCodeGenerator(config)
-    return generator.generate(hatching_lines, contours, image_width, image_height)
\ No newline at end of file
+    generator = GCodeGenerator(config, out)
+    return generator.generate(hatching_lines, contours, image_width, image_height)
+
+def generate_sketch_gcode_packed(
+    hatching: Tuple[np.ndarray, np.ndarray],
+    contours: Tuple[np.ndarray, np.ndarray],
+    image_width: int,
+    image_height: int,
+    config: dict,
+    optimize_order: bool = True,
+    header: str = ""
+) -> str:
+    # Линии приходят парами (точки, длины): так их дешево передавать в другой процесс.
+    # Штриховка из одних отрезков остается единым массивом (M, 2, 2) до самой записи G-кода
+    points, lengths = hatching
+    if len(lengths) and (lengths == 2).all():
+        hatching_lines = points.reshape(-1, 2, 2)
+    else:
+        hatching_lines = _split_packed(points, lengths)
+    # Заголовок пишется в тот же буфер, чтобы не копировать готовый G-код ради склейки
+    buf = io.StringIO()
+    buf.write(header)
+    generate_sketch_gcode(
+        hatching_lines,
+        [contour.reshape(-1, 1, 2) for contour in _split_packed(*contours)],
+        image_width, image_height, config, optimize_order, buf
+    )
+    return buf.getvalue()
+
+
+def _split_packed(points: np.ndarray, lengths: np.ndarray) -> List[np.ndarray]:
+    if not len(lengths):
+        return []
+    return np.split(points, np.cumsum(lengths)[:-1])
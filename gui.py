@@ -1,54 +1,83 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import cv2
 import numpy as np
+import hashlib
+import io
+import multiprocessing
 import os
+import pickle
+import queue
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from config import DEFAULT_CONFIG
-from utils import display_image_on_canvas, auto_adjust_scale, validate_numeric_input
-from image_processing import get_contours, generate_hatching
-from gcode_generator import generate_sketch_gcode
+from utils import display_image_on_canvas, resize_image, auto_adjust_scale, validate_numeric_input
+from image_processing import (
+    get_contours, generate_hatching, limit_image_size, scale_contours, scale_lines,
+    pack_lines, unpack_lines
+)
+from gcode_generator import generate_sketch_gcode_packed
 from hershey_fonts import text_to_gcode_cyrillic, add_cyrillic_text_to_contours
 from serial_port import ConnectionManager, SerialConnection
 
+# Половина ядер: вторую половину занимает параллельная генерация штриховки
+cv2.setNumThreads(max(1, (os.cpu_count() or 2) // 2))
+
+_UI_INT_FIELDS = (
+    ("canny_min", "canny_min_slider"),
+    ("canny_max", "canny_max_slider"),
+    ("hatch_density", "hatch_slider"),
+    ("hatch_angle", "angle_slider"),
+)
+
+_UI_DIRECT_FIELDS = (
+    ("draw_hatching", "hatch_var"),
+    ("hatch_cross", "cross_var"),
+    ("text_align", "align_var"),
+)
+
+# (ключ конфигурации, элемент интерфейса, приведение типа, мин., макс., по умолчанию)
+_UI_NUMERIC_FIELDS = (
+    ("work_area_x", "work_x_entry", None, 50, 1000, 0),
+    ("work_area_y", "work_y_entry", None, 50, 1000, 0),
+    ("pen_up_z", "pen_up_entry", None, 1.0, 50.0, 0),
+    ("pen_down_z", "pen_down_entry", None, -10.0, -0.1, 0),
+    ("feed_rate", "feed_rate_entry", None, 100, 5000, 0),
+    ("rapid_feed_rate", "rapid_rate_entry", None, 500, 10000, 0),
+    ("min_contour_length", "min_contour_entry", int, 5, 1000, 5),
+    ("min_line_length", "min_line_entry", int, 2, 1000, 2),
+    ("morph_kernel_size", "morph_kernel_entry", int, 1, 15, 3),
+    ("morph_iterations", "morph_iter_entry", int, 1, 10, 1),
+    ("blur_kernel", "blur_kernel_entry", int, 1, 25, 5),
+    ("blur_sigma", "blur_sigma_entry", float, 0.1, 10.0, 1.0),
+)
+
 class ConfigManager:
     def __init__(self, default_config):
         self.config = default_config.copy()
         
-    def update_from_ui(self, ui_elements):
+    def update_from_ui(self, ui_elements, show_errors=True):
         try:
+            values = {key: int(ui_elements[name].get()) for key, name in _UI_INT_FIELDS}
+            values.update((key, ui_elements[name].get()) for key, name in _UI_DIRECT_FIELDS)
+            validate = validate_numeric_input
+            for key, name, cast, min_val, max_val, default in _UI_NUMERIC_FIELDS:
+                value = validate(ui_elements[name].get(), min_val, max_val, default)
+                values[key] = cast(value) if cast else value
             font_size_pt = float(ui_elements["font_size_entry"].get())
-            font_scale = (font_size_pt / 12) * 0.4
-            self.config.update({
-                "canny_min": int(ui_elements["canny_min_slider"].get()),
-                "canny_max": int(ui_elements["canny_max_slider"].get()),
-                "hatch_density": int(ui_elements["hatch_slider"].get()),
-                "hatch_angle": int(ui_elements["angle_slider"].get()),
-                "draw_hatching": ui_elements["hatch_var"].get(),
-                "hatch_cross": ui_elements["cross_var"].get(),
-                "work_area_x": validate_numeric_input(ui_elements["work_x_entry"].get(), 50, 1000),
-                "work_area_y": validate_numeric_input(ui_elements["work_y_entry"].get(), 50, 1000),
-                "pen_up_z": validate_numeric_input(ui_elements["pen_up_entry"].get(), 1.0, 50.0),
-                "pen_down_z": validate_numeric_input(ui_elements["pen_down_entry"].get(), -10.0, -0.1),
-                "feed_rate": validate_numeric_input(ui_elements["feed_rate_entry"].get(), 100, 5000),
-                "rapid_feed_rate": validate_numeric_input(ui_elements["rapid_rate_entry"].get(), 500, 10000),
-                "min_contour_length": max(5, int(validate_numeric_input(ui_elements["min_contour_entry"].get(), 5, 1000))),
-                "min_line_length": max(2, int(validate_numeric_input(ui_elements["min_line_entry"].get(), 2, 1000))),
-                "font_scale": font_scale,  
-                "font_spacing": float(ui_elements["font_spacing_slider"].get()),
-                "text_position_x": float(ui_elements["text_pos_x_entry"].get()) / self.config["work_area_x"],
-                "text_position_y": float(ui_elements["text_pos_y_entry"].get()) / self.config["work_area_y"],
-                "text_align": ui_elements["align_var"].get(),
-                "morph_kernel_size": max(1, int(validate_numeric_input(ui_elements["morph_kernel_entry"].get(), 1, 15, 3))),
-                "morph_iterations": max(1, int(validate_numeric_input(ui_elements["morph_iter_entry"].get(), 1, 10, 1))),
-                "blur_kernel": max(1, int(validate_numeric_input(ui_elements["blur_kernel_entry"].get(), 1, 25, 5))),
-                "blur_sigma": max(0.1, float(validate_numeric_input(ui_elements["blur_sigma_entry"].get(), 0.1, 10.0, 1.0))),
-            })
+            values["font_scale"] = (font_size_pt / 12) * 0.4
+            values["font_spacing"] = float(ui_elements["font_spacing_slider"].get())
+            values["text_position_x"] = float(ui_elements["text_pos_x_entry"].get()) / self.config["work_area_x"]
+            values["text_position_y"] = float(ui_elements["text_pos_y_entry"].get()) / self.config["work_area_y"]
+            self.config.update(values)
             return True
         except ValueError as e:
-            messagebox.showerror("Ошибка ввода", f"Проверьте корректность параметров:\n{str(e)}")
+            if show_errors:
+                messagebox.showerror("Ошибка ввода", f"Проверьте корректность параметров:\n{str(e)}")
             return False
             
     def reset_to_default(self, default_config):
@@ -57,43 +86,136 @@ class ConfigManager:
 
 class PreviewRenderer:
     @staticmethod
-    def create_image_preview(original_image, lines, contours, text_contours):
+    def create_image_preview(original_image, lines, contours, text_contours, max_size=None):
         if original_image is None:
             return None
             
         img_width, img_height = original_image.size
-        preview = Image.new('RGB', (img_width, img_height), (255, 255, 255))
-        draw = ImageDraw.Draw(preview)
+        ratio = 1.0
+        if max_size:
+            ratio = min(max_size[0] / img_width, max_size[1] / img_height, 1.0)
+        width = max(1, round(img_width * ratio))
+        height = max(1, round(img_height * ratio))
+        # Без текста превью монохромное - достаточно одного канала
+        shape = (height, width, 3) if text_contours else (height, width)
+        canvas = np.full(shape, 255, dtype=np.uint8)
         
-        PreviewRenderer._draw_hatching(draw, lines)
-        PreviewRenderer._draw_contours(draw, contours, (0, 0, 0))
-        PreviewRenderer._draw_contours(draw, text_contours, (255, 0, 0))
+        PreviewRenderer._draw_hatching(canvas, lines, ratio)
+        PreviewRenderer._draw_contours(canvas, contours, (0, 0, 0), ratio)
+        PreviewRenderer._draw_contours(canvas, text_contours, (255, 0, 0), ratio)
         
-        return preview
+        return Image.fromarray(canvas)
         
     @staticmethod
-    def _draw_hatching(draw, lines):
-        for line in lines:
-            if len(line) > 1:
-                for i in range(len(line) - 1):
-                    x1, y1 = line[i]
-                    x2, y2 = line[i + 1]
-                    draw.line([(x1, y1), (x2, y2)], fill=(150, 150, 150), width=1)
+    def _draw_hatching(canvas, lines, ratio=1.0):
+        points, lengths = pack_lines([line for line in lines if len(line) > 1], np.float64)
+        if lengths.size:
+            points = np.rint(points * ratio).astype(np.int32)
+            polylines = [line.reshape(-1, 1, 2) for line in unpack_lines(points, lengths)]
+            cv2.polylines(canvas, polylines, False, (150, 150, 150), 1, cv2.LINE_8)
                     
     @staticmethod
-    def _draw_contours(draw, contours, color):
-        for contour in contours:
-            if len(contour) > 2:
-                points = [(point[0][0], point[0][1]) for point in contour]
-                draw.polygon(points, outline=color, width=2)
+    def _draw_contours(canvas, contours, color, ratio=1.0):
+        closed = [contour for contour in contours if contour.shape[0] > 2]
+        if not closed:
+            return
+        if ratio != 1.0:
+            points, lengths = pack_lines(closed, np.float64)
+            points = np.rint(points * ratio).astype(np.int32)
+            closed = [contour.reshape(-1, 1, 2) for contour in unpack_lines(points, lengths)]
+        cv2.drawContours(canvas, closed, -1, color, 2, cv2.LINE_AA)
+
+class PolylineDiskCache:
+    # Меняется при любом изменении обработки или формата файла: старые записи перестают находиться
+    FORMAT_VERSION = 2
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        
+    def _path(self, key):
+        name = hashlib.sha1(repr((self.FORMAT_VERSION, key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".pkl")
+        
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                points, lengths, tail = pickle.load(f)
+            polylines = [item.reshape((-1,) + tail) for item in unpack_lines(points, lengths)]
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Обрезанный или устаревший файл - промах кэша, запись удаляется
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return polylines
+        
+    def put(self, key, polylines):
+        tail = tuple(polylines[0].shape[1:]) if polylines else (2,)
+        points, lengths = pack_lines(polylines, polylines[0].dtype if polylines else np.int32)
+        path = self._path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((points, lengths, tail), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            pass
+            
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
 
 class ImageToGCodeApp:
+    CACHE_SIZE = 8
+    PREVIEW_DELAY_MS = 200
+    RESIZE_DELAY_MS = 80
+    RENDER_INTERVAL_MS = 33
+    POLL_INTERVAL_MS = 50
+    GCODE_DISPLAY_LINES = 5000
+    GCODE_INSERT_CHUNK = 64 * 1024
+    DISK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".imggcode_cache")
+    DISK_CACHE_MAX_BYTES = 200 * 1024 * 1024
+    CONFIG_ERROR_STATUS = "Проверьте корректность параметров"
+    
     def __init__(self, root):
         self.root = root
         self.root.title("PyPlotter")
         self.root.geometry("1400x850")
         
         self.original_image = None
+        self._work_gray = None
+        self._thumbnail = None
+        self._thumbnail_job = None
+        self._image_key = None
+        self._contour_cache = OrderedDict()
+        self._hatch_cache = OrderedDict()
+        self._disk_cache = PolylineDiskCache(self.DISK_CACHE_DIR, self.DISK_CACHE_MAX_BYTES)
+        self._pending_job = None
+        self._request_id = 0
+        self._resize_job = None
+        self._render_job = None
+        self._gcode_insert_job = None
+        self._gcode_shown = 0
+        self._shown_previews = {}
+        self._preview_inputs = None
+        self._config_dirty = False
         self.processed_image = None
         self.lines = []
         self.contours = []
@@ -114,6 +236,9 @@ class ImageToGCodeApp:
         
         self.connection_manager = ConnectionManager(self)
         self.is_connected = False
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._process_pool = None
+        self._result_q = queue.Queue()
         
         self.create_widgets()
         self.root.bind('<Configure>', self.on_resize)
@@ -161,11 +286,17 @@ class ImageToGCodeApp:
         self.device_combo.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky="ew")
         self.device_combo.bind("<<ComboboxSelected>>", self.on_device_selected)
         
+        ttk.Label(connection_frame, text="Скорость (бод):").grid(row=2, column=0, padx=5, pady=5, sticky="e")
+        self.baud_combo = ttk.Combobox(connection_frame, width=10, state="readonly",
+                                       values=SerialConnection.SUPPORTED_BAUDS)
+        self.baud_combo.set(SerialConnection.DEFAULT_BAUDRATE)
+        self.baud_combo.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        
         refresh_btn = ttk.Button(connection_frame, text="Обновить список", command=self.refresh_devices)
-        refresh_btn.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        refresh_btn.grid(row=3, column=1, padx=5, pady=5, sticky="w")
         
         self.connect_btn = ttk.Button(connection_frame, text="Подключиться", command=self.toggle_connection)
-        self.connect_btn.grid(row=2, column=2, padx=5, pady=5, sticky="e")
+        self.connect_btn.grid(row=3, column=2, padx=5, pady=5, sticky="e")
         
         connection_frame.columnconfigure(1, weight=1)
         connection_frame.columnconfigure(2, weight=1)
@@ -216,58 +347,26 @@ class ImageToGCodeApp:
         image_frame = ttk.LabelFrame(parent_frame, text="Параметры обработки изображения")
         image_frame.pack(fill=tk.X, padx=10, pady=5)
         
-        ttk.Label(image_frame, text="Canny Min:").grid(row=0, column=0, padx=5, pady=2, sticky="e")
-        self.canny_min_slider = tk.Scale(image_frame, from_=0, to=255, orient=tk.HORIZONTAL, length=120)
-        self.canny_min_slider.set(self.config["canny_min"])
-        self.canny_min_slider.grid(row=0, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Canny Max:").grid(row=1, column=0, padx=5, pady=2, sticky="e")
-        self.canny_max_slider = tk.Scale(image_frame, from_=0, to=255, orient=tk.HORIZONTAL, length=120)
-        self.canny_max_slider.set(self.config["canny_max"])
-        self.canny_max_slider.grid(row=1, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Размер ядра размытия:").grid(row=2, column=0, padx=5, pady=2, sticky="e")
-        self.blur_kernel_entry = ttk.Entry(image_frame, width=8)
-        self.blur_kernel_entry.insert(0, str(self.config.get("blur_kernel", 5)))
-        self.blur_kernel_entry.grid(row=2, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Сигма размытия:").grid(row=3, column=0, padx=5, pady=2, sticky="e")
-        self.blur_sigma_entry = ttk.Entry(image_frame, width=8)
-        self.blur_sigma_entry.insert(0, str(self.config.get("blur_sigma", 1.0)))
-        self.blur_sigma_entry.grid(row=3, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Размер ядра морфологии:").grid(row=4, column=0, padx=5, pady=2, sticky="e")
-        self.morph_kernel_entry = ttk.Entry(image_frame, width=8)
-        self.morph_kernel_entry.insert(0, str(self.config.get("morph_kernel_size", 3)))
-        self.morph_kernel_entry.grid(row=4, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Итерации морфологии:").grid(row=5, column=0, padx=5, pady=2, sticky="e")
-        self.morph_iter_entry = ttk.Entry(image_frame, width=8)
-        self.morph_iter_entry.insert(0, str(self.config.get("morph_iterations", 1)))
-        self.morph_iter_entry.grid(row=5, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Мин. длина контура:").grid(row=6, column=0, padx=5, pady=2, sticky="e")
-        self.min_contour_entry = ttk.Entry(image_frame, width=8)
-        self.min_contour_entry.insert(0, str(self.config["min_contour_length"]))
-        self.min_contour_entry.grid(row=6, column=1, padx=5, pady=2)
-        
-        ttk.Label(image_frame, text="Мин. длина линии:").grid(row=7, column=0, padx=5, pady=2, sticky="e")
-        self.min_line_entry = ttk.Entry(image_frame, width=8)
-        self.min_line_entry.insert(0, str(self.config["min_line_length"]))
-        self.min_line_entry.grid(row=7, column=1, padx=5, pady=2)
+        self._add_sliders(image_frame, [
+            ("Canny Min:", "canny_min_slider", 0, 255, self.config["canny_min"]),
+            ("Canny Max:", "canny_max_slider", 0, 255, self.config["canny_max"]),
+        ])
+        self._add_entries(image_frame, [
+            ("Размер ядра размытия:", "blur_kernel_entry", self.config.get("blur_kernel", 5)),
+            ("Сигма размытия:", "blur_sigma_entry", self.config.get("blur_sigma", 1.0)),
+            ("Размер ядра морфологии:", "morph_kernel_entry", self.config.get("morph_kernel_size", 3)),
+            ("Итерации морфологии:", "morph_iter_entry", self.config.get("morph_iterations", 1)),
+            ("Мин. длина контура:", "min_contour_entry", self.config["min_contour_length"]),
+            ("Мин. длина линии:", "min_line_entry", self.config["min_line_length"]),
+        ], first_row=2)
         
         hatch_frame = ttk.LabelFrame(parent_frame, text="Параметры штриховки")
         hatch_frame.pack(fill=tk.X, padx=10, pady=5)
         
-        ttk.Label(hatch_frame, text="Плотность:").grid(row=0, column=0, padx=5, pady=2, sticky="e")
-        self.hatch_slider = tk.Scale(hatch_frame, from_=1, to=20, orient=tk.HORIZONTAL, length=120)
-        self.hatch_slider.set(self.config["hatch_density"])
-        self.hatch_slider.grid(row=0, column=1, padx=5, pady=2)
-        
-        ttk.Label(hatch_frame, text="Угол (град):").grid(row=1, column=0, padx=5, pady=2, sticky="e")
-        self.angle_slider = tk.Scale(hatch_frame, from_=0, to=180, orient=tk.HORIZONTAL, length=120)
-        self.angle_slider.set(self.config["hatch_angle"])
-        self.angle_slider.grid(row=1, column=1, padx=5, pady=2)
+        self._add_sliders(hatch_frame, [
+            ("Плотность:", "hatch_slider", 1, 20, self.config["hatch_density"]),
+            ("Угол (град):", "angle_slider", 0, 180, self.config["hatch_angle"]),
+        ])
         
         self.hatch_var = tk.BooleanVar(value=self.config["draw_hatching"])
         ttk.Checkbutton(hatch_frame, text="Рисовать штриховку", variable=self.hatch_var).grid(row=2, column=0, columnspan=2, padx=5, pady=2, sticky="w")
@@ -278,35 +377,14 @@ class ImageToGCodeApp:
         machine_frame = ttk.LabelFrame(parent_frame, text="Параметры станка")
         machine_frame.pack(fill=tk.X, padx=10, pady=5)
         
-        ttk.Label(machine_frame, text="Рабочая область X (мм):").grid(row=0, column=0, padx=5, pady=2, sticky="e")
-        self.work_x_entry = ttk.Entry(machine_frame, width=8)
-        self.work_x_entry.insert(0, str(self.config["work_area_x"]))
-        self.work_x_entry.grid(row=0, column=1, padx=5, pady=2)
-        
-        ttk.Label(machine_frame, text="Рабочая область Y (мм):").grid(row=1, column=0, padx=5, pady=2, sticky="e")
-        self.work_y_entry = ttk.Entry(machine_frame, width=8)
-        self.work_y_entry.insert(0, str(self.config["work_area_y"]))
-        self.work_y_entry.grid(row=1, column=1, padx=5, pady=2)
-        
-        ttk.Label(machine_frame, text="Z поднято (мм):").grid(row=2, column=0, padx=5, pady=2, sticky="e")
-        self.pen_up_entry = ttk.Entry(machine_frame, width=8)
-        self.pen_up_entry.insert(0, str(self.config["pen_up_z"]))
-        self.pen_up_entry.grid(row=2, column=1, padx=5, pady=2)
-        
-        ttk.Label(machine_frame, text="Z опущено (мм):").grid(row=3, column=0, padx=5, pady=2, sticky="e")
-        self.pen_down_entry = ttk.Entry(machine_frame, width=8)
-        self.pen_down_entry.insert(0, str(self.config["pen_down_z"]))
-        self.pen_down_entry.grid(row=3, column=1, padx=5, pady=2)
-        
-        ttk.Label(machine_frame, text="Скорость подачи (мм/мин):").grid(row=4, column=0, padx=5, pady=2, sticky="e")
-        self.feed_rate_entry = ttk.Entry(machine_frame, width=8)
-        self.feed_rate_entry.insert(0, str(self.config["feed_rate"]))
-        self.feed_rate_entry.grid(row=4, column=1, padx=5, pady=2)
-        
-        ttk.Label(machine_frame, text="Быстрая подача (мм/мин):").grid(row=5, column=0, padx=5, pady=2, sticky="e")
-        self.rapid_rate_entry = ttk.Entry(machine_frame, width=8)
-        self.rapid_rate_entry.insert(0, str(self.config["rapid_feed_rate"]))
-        self.rapid_rate_entry.grid(row=5, column=1, padx=5, pady=2)
+        self._add_entries(machine_frame, [
+            ("Рабочая область X (мм):", "work_x_entry", self.config["work_area_x"]),
+            ("Рабочая область Y (мм):", "work_y_entry", self.config["work_area_y"]),
+            ("Z поднято (мм):", "pen_up_entry", self.config["pen_up_z"]),
+            ("Z опущено (мм):", "pen_down_entry", self.config["pen_down_z"]),
+            ("Скорость подачи (мм/мин):", "feed_rate_entry", self.config["feed_rate"]),
+            ("Быстрая подача (мм/мин):", "rapid_rate_entry", self.config["rapid_feed_rate"]),
+        ])
         
         text_frame = ttk.LabelFrame(parent_frame, text="Параметры русского текста")
         text_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -340,6 +418,23 @@ class ImageToGCodeApp:
                                    values=["left", "center", "right"], width=10, state="readonly")
         align_combo.grid(row=4, column=1, padx=5, pady=2, sticky="w")
         
+    def _add_sliders(self, frame, fields, first_row=0):
+        for row, (label, attr, from_, to, value) in enumerate(fields, first_row):
+            ttk.Label(frame, text=label).grid(row=row, column=0, padx=5, pady=2, sticky="e")
+            slider = tk.Scale(frame, from_=from_, to=to, orient=tk.HORIZONTAL, length=120,
+                              command=self._schedule_preview)
+            slider.set(value)
+            slider.grid(row=row, column=1, padx=5, pady=2)
+            setattr(self, attr, slider)
+            
+    def _add_entries(self, frame, fields, first_row=0):
+        for row, (label, attr, value) in enumerate(fields, first_row):
+            ttk.Label(frame, text=label).grid(row=row, column=0, padx=5, pady=2, sticky="e")
+            entry = ttk.Entry(frame, width=8)
+            entry.insert(0, str(value))
+            entry.grid(row=row, column=1, padx=5, pady=2)
+            setattr(self, attr, entry)
+        
     def on_tab_changed(self, event):
         self.update_control_buttons()
         
@@ -372,6 +467,7 @@ class ImageToGCodeApp:
         notebook.add(gcode_frame, text="G-код")
         
         self.gcode_text = scrolledtext.ScrolledText(gcode_frame, width=80, height=25, font=("Courier", 10))
+        self.gcode_text.configure(yscrollcommand=self._on_gcode_scroll)
         self.gcode_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         self.gcode_stats_var = tk.StringVar(value="Статистика будет доступна после генерации G-кода")
@@ -398,6 +494,8 @@ class ImageToGCodeApp:
             
             preview_btn = ttk.Button(self.control_button_frame, text="Обработка изображения", 
                                     command=self.process_image, width=25)
+            if self.processing:
+                preview_btn.config(state="disabled")
             preview_btn.pack(side=tk.LEFT, padx=5)
             
             gcode_btn = ttk.Button(self.control_button_frame, text="Сгенерировать G-код", 
@@ -449,7 +547,7 @@ class ImageToGCodeApp:
         if self.gcode:
             self.root.clipboard_clear()
             self.root.clipboard_append(self.gcode)
-            self.root.update()
+            self.root.update_idletasks()
             self.status_var.set("G-код скопирован в буфер обмена")
             
     def create_status_bar(self):
@@ -503,13 +601,53 @@ class ImageToGCodeApp:
             "blur_kernel_entry": self.blur_kernel_entry,
             "blur_sigma_entry": self.blur_sigma_entry,
         }
+        for name, widget in self.ui_elements.items():
+            if name.endswith("_slider"):
+                widget.bind("<ButtonRelease>", self._mark_config_dirty, add="+")
+            elif name.endswith("_entry"):
+                widget.bind("<FocusOut>", self._mark_config_dirty, add="+")
+                widget.bind("<Return>", self._mark_config_dirty, add="+")
+            elif name.endswith("_var"):
+                widget.trace_add("write", lambda *_: self._mark_config_dirty())
+                
+    def _mark_config_dirty(self, _event=None):
+        # Несколько изменений за один цикл событий дают одно чтение параметров
+        if not self._config_dirty:
+            self._config_dirty = True
+            self.root.after_idle(self._flush_config)
+            
+    def _flush_config(self):
+        self._config_dirty = False
+        self._sync_config(show_errors=False)
+        
+    def _sync_config(self, show_errors):
+        # Единственный путь чтения параметров из интерфейса; ошибка видна в строке состояния
+        if self.config_manager.update_from_ui(self.ui_elements, show_errors):
+            if self.status_var.get() == self.CONFIG_ERROR_STATUS:
+                self.status_var.set("Параметры обновлены")
+            return True
+        self.status_var.set(self.CONFIG_ERROR_STATUS)
+        return False
         
     def on_resize(self, event):
-        if self.original_image:
+        if event.widget is not self.root or not self.original_image:
+            return
+        if self._resize_job:
+            self.root.after_cancel(self._resize_job)
+        self._resize_job = self.root.after(self.RESIZE_DELAY_MS, self._do_resize)
+        
+    def _do_resize(self):
+        self._resize_job = None
+        if not self.original_image:
+            return
+        if self.processed_image is not None:
+            # Превью обработки растеризовано под прежний размер холста - рисуем его заново
+            self._schedule_render()
+        else:
             self.update_previews()
             
     def update_config_from_ui(self):
-        return self.config_manager.update_from_ui(self.ui_elements)
+        return self._sync_config(show_errors=True)
         
     def load_image(self):
         if self.processing:
@@ -524,10 +662,25 @@ class ImageToGCodeApp:
             
         try:
             self.status_var.set(f"Загрузка изображения: {os.path.basename(file_path)}")
-            self.root.update()
-            self.original_image = Image.open(file_path)
-            if self.original_image.mode != 'RGB':
-                self.original_image = self.original_image.convert('RGB')
+            self.root.update_idletasks()
+            # Декодированный BGR-буфер не сохраняется: серое изображение строится из original_image
+            img_bgr = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img_bgr is not None:
+                self.original_image = Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+                del img_bgr
+            else:
+                # Формат не поддерживается OpenCV - используем PIL
+                self.original_image = Image.open(file_path)
+                if self.original_image.mode not in ('RGB', 'RGBA', 'L'):
+                    self.original_image = self.original_image.convert('RGB')
+                # Декодируем сразу: дальше изображение читают фоновые потоки
+                self.original_image.load()
+            self._work_gray = None
+            self._thumbnail = None
+            self._image_key = hashlib.sha1(
+                f"{os.path.abspath(file_path)}|{os.path.getmtime(file_path)}".encode("utf-8")
+            ).hexdigest()
+            self._clear_processing_cache()
             self.update_previews()
             auto_adjust_scale(self.original_image, self.config)
             default_x = self.config.get("work_area_x", 100) * 0.5
@@ -546,7 +699,7 @@ class ImageToGCodeApp:
             self.contours = []
             self.text_contours = []
             self.gcode = ""
-            self.gcode_text.delete(1.0, tk.END)
+            self._clear_gcode_text()
             self.processed_canvas.delete("all")
             self.gcode_stats_var.set("Статистика будет доступна после генерации G-кода")
             self.update_control_buttons()
@@ -554,12 +707,145 @@ class ImageToGCodeApp:
             messagebox.showerror("Ошибка загрузки", f"Не удалось загрузить изображение:\n{str(e)}")
             self.status_var.set("Ошибка загрузки изображения")
             
+    def _get_work_gray(self, max_size):
+        # Хранится только уменьшенная серая копия, полноразмерные буферы сразу освобождаются
+        if self._work_gray is None or self._work_gray[0] != max_size:
+            pixels = np.asarray(self.original_image)
+            mode = self.original_image.mode
+            if mode == 'L':
+                gray = pixels
+            else:
+                gray = cv2.cvtColor(pixels, cv2.COLOR_RGBA2GRAY if mode == 'RGBA' else cv2.COLOR_RGB2GRAY)
+            del pixels
+            self._work_gray = (max_size, limit_image_size(gray, max_size))
+        return self._work_gray[1]
+        
+    def _clear_processing_cache(self):
+        self._contour_cache.clear()
+        self._hatch_cache.clear()
+        self._preview_inputs = None
+        
+    def _cached(self, cache, key, compute, disk_key=None):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = None
+        if disk_key is not None:
+            value = self._disk_cache.get(disk_key)
+        if value is None:
+            value = compute()
+            if disk_key is not None:
+                self._disk_cache.put(disk_key, value)
+        cache[key] = value
+        if len(cache) > self.CACHE_SIZE:
+            cache.popitem(last=False)
+        return value
+            
+    def _preview_size(self, canvas=None):
+        canvas = canvas or self.processed_canvas
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return 400, 400
+        return width, height
+        
+    def _original_thumbnail(self):
+        # Уменьшенная копия исходника с запасом 20%: пересчитывается при заметном изменении холста
+        width, height = self._preview_size(self.original_canvas)
+        if self._thumbnail:
+            (base_w, base_h), thumbnail = self._thumbnail
+            if abs(width - base_w) <= base_w * 0.2 and abs(height - base_h) <= base_h * 0.2:
+                return thumbnail
+        image = self.original_image
+        img_width, img_height = image.size
+        ratio = min(width * 1.2 / img_width, height * 1.2 / img_height)
+        if ratio >= 1.0:
+            self._thumbnail = ((width, height), image)
+            return image
+        
+        # Большое изображение уменьшается в фоне, пока показывается прежняя копия
+        job = (image, (width, height))
+        if not (self._thumbnail_job and self._thumbnail_job[0] is image and self._thumbnail_job[1] == job[1]):
+            self._thumbnail_job = job
+            size = (max(1, round(img_width * ratio)), max(1, round(img_height * ratio)))
+            future = self._executor.submit(resize_image, image, size)
+            self._watch_future(future, lambda done: self._on_thumbnail_done(done, job))
+        return self._thumbnail[1] if self._thumbnail else None
+        
+    def _on_thumbnail_done(self, future, job):
+        if self._thumbnail_job is job:
+            self._thumbnail_job = None
+        if job[0] is not self.original_image or future.exception() is not None:
+            return
+        self._thumbnail = (job[1], future.result())
+        self.update_previews()
+            
     def update_previews(self):
         if self.original_image:
-            display_image_on_canvas(self.original_image, self.original_canvas)
+            thumbnail = self._original_thumbnail()
+            if thumbnail is not None:
+                self._show_preview(thumbnail, self.original_canvas)
         if self.processed_image:
-            display_image_on_canvas(self.processed_image, self.processed_canvas)
+            self._show_preview(self.processed_image, self.processed_canvas)
+            
+    def _render_processed_preview(self):
+        # Превью перерисовывается только при смене входных данных или размера холста
+        size = self._preview_size()
+        inputs = (self.original_image, self.lines, self.contours, self.text_contours or None)
+        last = self._preview_inputs
+        if last and last[1] == size and all(a is b for a, b in zip(inputs, last[0])):
+            return
+        self.processed_image = PreviewRenderer.create_image_preview(
+            self.original_image, self.lines, self.contours, self.text_contours, size
+        )
+        self._preview_inputs = (inputs, size)
+        
+    def _schedule_render(self):
+        # Несколько изменений подряд дают одну перерисовку не чаще ~30 раз в секунду
+        if self._render_job is None:
+            self._render_job = self.root.after(self.RENDER_INTERVAL_MS, self._do_render)
+            
+    def _do_render(self):
+        self._render_job = None
+        if self.original_image:
+            self._render_processed_preview()
+            self.update_previews()
+            
+    def _show_preview(self, image, canvas):
+        # Повторно не масштабируем и не загружаем в Tk то, что уже показано
+        state = (image, canvas.winfo_width(), canvas.winfo_height())
+        shown = self._shown_previews.get(canvas)
+        if shown and shown[0] is state[0] and shown[1:] == state[1:] and canvas.find_withtag("image"):
+            return
+        display_image_on_canvas(image, canvas)
+        self._shown_previews[canvas] = state
             
+    def _schedule_preview(self, _value=None):
+        if self.processed_image is None:
+            return
+        # Результат уже запущенной обработки устарел: его не показываем
+        self._request_id += 1
+        if self._pending_job:
+            self.root.after_cancel(self._pending_job)
+        self._pending_job = self.root.after(self.PREVIEW_DELAY_MS, self._run_scheduled_preview)
+        
+    def _run_scheduled_preview(self):
+        self._pending_job = None
+        if self.processed_image is None:
+            return
+        if self.processing:
+            self._schedule_preview()
+            return
+        self._reprocess()
+        
+    def _reprocess(self):
+        # Переобработка по ползункам идет без диалогов, добавленный текст сохраняется
+        if self.original_image is None:
+            return
+        if not self._sync_config(show_errors=False):
+            return
+        self._start_processing(keep_text=True)
+        
     def process_image(self):
         if self.processing:
             messagebox.showwarning("Занято", "Обработка уже выполняется")
@@ -573,52 +859,146 @@ class ImageToGCodeApp:
             return
             
         self.text_contours = []
+        self._start_processing(keep_text=False)
+        
+    def _start_processing(self, keep_text):
         self.processing = True
+        self.status_var.set("Обработка изображения...")
         self.progress.pack(fill=tk.X, padx=5, pady=2)
         self.progress.start()
-        threading.Thread(target=self._process_image_thread, daemon=True).start()
+        self.update_control_buttons()
+        future = self._executor.submit(self._process_image_worker, dict(self.config), self._preview_size())
+        request_id = self._request_id
+        self._watch_future(future, lambda done: self._on_process_done(done, request_id, keep_text))
+        
+    def shutdown(self):
+        # Очередь задач отменяется, чтобы закрытие окна не ждало фоновой работы
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            # Идущая генерация прерывается: иначе интерпретатор ждал бы процесс при выходе.
+            # Других дочерних процессов приложение не создает
+            for process in multiprocessing.active_children():
+                process.terminate()
+            self._process_pool = None
+        
+    def _get_process_pool(self):
+        # Процесс генерации создается при первой генерации G-кода, а не при запуске
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._process_pool
         
-    def _process_image_thread(self):
+    def _submit_to_process(self, fn, *args):
         try:
-            self.status_var.set("Обработка изображения...")
-            self.root.update()
-            img_cv = np.array(self.original_image)
-            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_RGB2BGR)
-            _, self.contours = get_contours(
-                img_cv, 
-                canny_min=self.config["canny_min"], 
-                canny_max=self.config["canny_max"],
-                blur_kernel=self.config["blur_kernel"],
-                blur_sigma=self.config["blur_sigma"],
-                morph_kernel_size=self.config["morph_kernel_size"],
-                morph_iterations=self.config["morph_iterations"],
-                min_contour_length=self.config["min_contour_length"]
+            return self._get_process_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            # Упавший процесс-обработчик заменяется новым
+            self._process_pool = None
+            return self._get_process_pool().submit(fn, *args)
+        
+    def _watch_future(self, future, on_done):
+        future.add_done_callback(lambda done: self._result_q.put((on_done, done)))
+        self.root.after(self.POLL_INTERVAL_MS, self._poll_results)
+        
+    def _poll_results(self):
+        # Tk вызывается только из главного потока: результат забирается из очереди
+        try:
+            on_done, future = self._result_q.get_nowait()
+        except queue.Empty:
+            self.root.after(self.POLL_INTERVAL_MS, self._poll_results)
+            return
+        on_done(future)
+        
+    def _process_image_worker(self, config, preview_size):
+        max_size = config.get("max_processing_size", DEFAULT_CONFIG["max_processing_size"])
+        work_img = self._get_work_gray(max_size)
+        img_width, img_height = self.original_image.size
+        scale_x = img_width / work_img.shape[1]
+        scale_y = img_height / work_img.shape[0]
+        contour_params = (
+            config["canny_min"],
+            config["canny_max"],
+            config["blur_kernel"],
+            config["blur_sigma"],
+            config["morph_kernel_size"],
+            config["morph_iterations"],
+            config["min_contour_length"],
+        )
+        hatch_future = None
+        if config["draw_hatching"]:
+            hatch_params = (
+                config["hatch_density"],
+                config["hatch_angle"],
+                config["hatch_cross"],
+                config["min_line_length"],
             )
-            self.lines = []
-            if self.config["draw_hatching"]:
-                self.lines = generate_hatching(
-                    img_cv, 
-                    self.config["hatch_density"], 
-                    self.config["hatch_angle"], 
-                    self.config["hatch_cross"],
-                    min_line_length=self.config["min_line_length"]
-                )
-            self.processed_image = PreviewRenderer.create_image_preview(
-                self.original_image, self.lines, self.contours, self.text_contours
+            disk_key = None
+            if self._image_key:
+                disk_key = (self._image_key, "hatching", max_size) + hatch_params
+            # Штриховка считается во втором потоке пула параллельно с контурами
+            hatch_future = self._executor.submit(
+                self._cached,
+                self._hatch_cache,
+                (id(self.original_image), max_size) + hatch_params,
+                lambda: self._detect_hatching(work_img, scale_x, scale_y, hatch_params),
+                disk_key
             )
+        disk_key = None
+        if self._image_key:
+            disk_key = (self._image_key, "contours", max_size) + contour_params
+        contours = self._cached(
+            self._contour_cache,
+            (id(self.original_image), max_size) + contour_params,
+            lambda: self._detect_contours(work_img, scale_x, scale_y, contour_params),
+            disk_key
+        )
+        lines = hatch_future.result() if hatch_future else []
+        preview = PreviewRenderer.create_image_preview(self.original_image, lines, contours, [], preview_size)
+        return contours, lines, preview
+        
+    def _on_process_done(self, future, request_id, keep_text=False):
+        try:
+            result = future.result()
+            if request_id != self._request_id:
+                return
+            self.contours, self.lines, self.processed_image = result
+            self._preview_inputs = None
+            if keep_text and self.current_text and self.text_contours:
+                # Положение текста зависит от новых контуров - текст накладывается заново
+                self.text_contours = self._compose_text_contours()
+                self._schedule_render()
             contour_count = len(self.contours)
             line_count = len(self.lines)
             self.stats_var.set(f"Контуры: {contour_count} | Линии штриховки: {line_count}")
             self.status_var.set(f"Обработка завершена. Контуры: {contour_count}, линии штриховки: {line_count}")
         except Exception as e:
-            error_msg = f"Ошибка обработки: {str(e)}"
             import traceback
             traceback.print_exc()
-            self.root.after(0, lambda: messagebox.showerror("Ошибка обработки", error_msg))
+            messagebox.showerror("Ошибка обработки", f"Ошибка обработки: {str(e)}")
             self.status_var.set("Ошибка обработки изображения")
             self.stats_var.set("")
         finally:
-            self.root.after(0, self._finish_processing)
+            self._finish_processing()
+            
+    @staticmethod
+    def _detect_contours(img, scale_x, scale_y, params):
+        *params, min_contour_length = params
+        min_contour_length = max(1, round(min_contour_length / scale_x))
+        _, contours = get_contours(img, *params, min_contour_length)
+        if scale_x == 1.0 and scale_y == 1.0:
+            return contours
+        return scale_contours(contours, scale_x, scale_y)
+        
+    @staticmethod
+    def _detect_hatching(img, scale_x, scale_y, params):
+        *params, min_line_length = params
+        min_line_length = max(1, round(min_line_length / scale_x))
+        lines = generate_hatching(img, *params, min_line_length=min_line_length)
+        if scale_x == 1.0 and scale_y == 1.0:
+            return lines
+        return scale_lines(lines, scale_x, scale_y)
             
     def _finish_processing(self):
         self.processing = False
@@ -641,34 +1021,38 @@ class ImageToGCodeApp:
             return
             
         try:
-            start_x = float(self.text_pos_x_entry.get())
-            start_y = float(self.text_pos_y_entry.get())
-            work_area_x = self.config.get("work_area_x", 100)
-            work_area_y = self.config.get("work_area_y", 100)
-            position = (start_x / work_area_x, start_y / work_area_y)
-            align = self.config["text_align"]
-            self.text_contours = add_cyrillic_text_to_contours(
-                self.current_text,
-                self.contours,
-                self.config,
-                position,
-                align
-            )
-            self.processed_image = PreviewRenderer.create_image_preview(
-                self.original_image, self.lines, self.contours, self.text_contours
-            )
-            self.update_previews()
+            self.text_contours = self._compose_text_contours()
+            self._schedule_render()
             display_text = self.current_text[:30] + "..." if len(self.current_text) > 30 else self.current_text
             self.status_var.set(f"Добавлен русский текст: '{display_text}'")
             self.update_control_buttons()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось добавить текст: {str(e)}")
             
+    def _compose_text_contours(self):
+        start_x = float(self.text_pos_x_entry.get())
+        start_y = float(self.text_pos_y_entry.get())
+        work_area_x = self.config.get("work_area_x", 100)
+        work_area_y = self.config.get("work_area_y", 100)
+        position = (start_x / work_area_x, start_y / work_area_y)
+        align = self.config["text_align"]
+        return add_cyrillic_text_to_contours(
+            self.current_text,
+            self.contours,
+            self.config,
+            position,
+            align
+        )
+            
     def clear_image(self):
         if not messagebox.askyesno("Очистка изображения", "Вы уверены, что хотите удалить всё содержимое?"):
             return
             
         self.original_image = None
+        self._work_gray = None
+        self._thumbnail = None
+        self._image_key = None
+        self._clear_processing_cache()
         self.processed_image = None
         self.lines = []
         self.contours = []
@@ -677,7 +1061,7 @@ class ImageToGCodeApp:
         self.gcode = ""
         self.original_canvas.delete("all")
         self.processed_canvas.delete("all")
-        self.gcode_text.delete(1.0, tk.END)
+        self._clear_gcode_text()
         self.gcode_stats_var.set("Статистика будет доступна после генерации G-кода")
         self.status_var.set("Изображение и все данные очищены.")
         self.stats_var.set("")
@@ -688,10 +1072,7 @@ class ImageToGCodeApp:
         self.current_text = ""
         self.text_entry.delete("1.0", tk.END)
         if self.original_image:
-            self.processed_image = PreviewRenderer.create_image_preview(
-                self.original_image, self.lines, self.contours, self.text_contours
-            )
-            self.update_previews()
+            self._schedule_render()
         self.status_var.set("Текст очищен")
         self.update_control_buttons()
         
@@ -725,32 +1106,35 @@ class ImageToGCodeApp:
         self.processing = True
         self.progress.pack(fill=tk.X, padx=5, pady=2)
         self.progress.start()
+        self.status_var.set("Генерация G-кода для русского текста...")
+        header = (
+            "; G-код для русского текста\n",
+            f"; Текст: {self.current_text}\n",
+            f"; Позиция: X={start_x:.2f}mm, Y={start_y:.2f}mm\n",
+            f"; Выравнивание: {self.config['text_align']}\n",
+            f"; Размер шрифта: {self.font_size_entry.get()}pt\n",
+        )
         threading.Thread(target=self._generate_text_gcode_thread, 
-                        args=(start_x, start_y), daemon=True).start()
+                        args=(start_x, start_y, header), daemon=True).start()
         
-    def _generate_text_gcode_thread(self, start_x, start_y):
+    def _generate_text_gcode_thread(self, start_x, start_y, header):
         try:
-            self.status_var.set("Генерация G-кода для русского текста...")
-            self.root.update()
-            self.gcode = text_to_gcode_cyrillic(
+            buf = io.StringIO()
+            buf.writelines(header)
+            text_to_gcode_cyrillic(
                 self.current_text,
                 self.config,
                 start_x,
                 start_y,
-                self.config["text_align"]
+                self.config["text_align"],
+                buf
             )
-            font_size_pt = self.font_size_entry.get()
-            header = f"; G-код для русского текста\n"
-            header += f"; Текст: {self.current_text}\n"
-            header += f"; Позиция: X={start_x:.2f}mm, Y={start_y:.2f}mm\n"
-            header += f"; Выравнивание: {self.config['text_align']}\n"
-            header += f"; Размер шрифта: {font_size_pt}pt\n"
-            self.gcode = header + self.gcode
+            self.gcode = buf.getvalue()
             self.root.after(0, self._update_gcode_display)
             self.root.after(0, lambda: self.status_var.set(
                 f"G-код для русского текста сгенерирован"
             ))
-            line_count = len(self.gcode.splitlines())
+            line_count = self.gcode.count("\n") + 1
             size_kb = len(self.gcode) // 1024
             stats_text = f"Строк: {line_count} | Размер: {size_kb} КБ | Режим: Только текст"
             self.root.after(0, lambda: self.gcode_stats_var.set(stats_text))
@@ -784,50 +1168,94 @@ class ImageToGCodeApp:
         self.processing = True
         self.progress.pack(fill=tk.X, padx=5, pady=2)
         self.progress.start()
-        threading.Thread(target=self._generate_gcode_thread, daemon=True).start()
+        self.status_var.set("Генерация G-кода...")
+        header = ""
+        if self.current_text and self.text_contours:
+            header = "".join((
+                f"; Добавлен русский текст: {self.current_text}\n",
+                f"; Выравнивание: {self.config['text_align']}\n",
+                f"; Размер шрифта: {self.font_size_entry.get()}pt\n",
+            ))
+        # Форматирование G-кода держит GIL, поэтому оно идет в отдельном процессе,
+        # а линии передаются туда упакованными массивами
+        future = self._submit_to_process(
+            generate_sketch_gcode_packed,
+            pack_lines(self.lines, np.float64),
+            pack_lines(self.contours + self.text_contours, np.float64),
+            self.original_image.size[0],
+            self.original_image.size[1],
+            dict(self.config),
+            self.config.get("optimize_order", True),
+            header
+        )
+        self._watch_future(future, self._on_gcode_done)
         
-    def _generate_gcode_thread(self):
+    def _on_gcode_done(self, future):
         try:
-            self.status_var.set("Генерация G-кода...")
-            self.root.update()
-            all_contours = self.contours + self.text_contours
-            self.gcode = generate_sketch_gcode(
-                hatching_lines=self.lines,
-                contours=all_contours,
-                image_width=self.original_image.size[0],
-                image_height=self.original_image.size[1],
-                config=self.config,
-                optimize_order=self.config.get("optimize_order", True)
-            )
-            if self.current_text and self.text_contours:
-                font_size_pt = self.font_size_entry.get()
-                text_info = f"; Добавлен русский текст: {self.current_text}\n"
-                text_info += f"; Выравнивание: {self.config['text_align']}\n"
-                text_info += f"; Размер шрифта: {font_size_pt}pt\n"
-                self.gcode = text_info + self.gcode
-            self.root.after(0, self._update_gcode_display)
+            self.gcode = future.result()
+            self._update_gcode_display()
             line_count = len(self.lines)
             contour_count = len(self.contours)
             text_contour_count = len(self.text_contours)
-            status = f"G-код сгенерирован. Штриховка: {line_count} линий, Контур: {contour_count}, Текст: {text_contour_count} контуров"
-            self.root.after(0, lambda: self.status_var.set(status))
-            total_lines = len(self.gcode.splitlines())
+            self.status_var.set(f"G-код сгенерирован. Штриховка: {line_count} линий, Контур: {contour_count}, Текст: {text_contour_count} контуров")
+            total_lines = self.gcode.count("\n")
             size_kb = len(self.gcode) // 1024
             mode = "Изображение + текст" if self.text_contours else "Только изображение"
-            stats_text = f"Строк: {total_lines} | Размер: {size_kb} КБ | Режим: {mode}"
-            self.root.after(0, lambda: self.gcode_stats_var.set(stats_text))
-            self.root.after(0, lambda: self.stats_var.set(f"Строк: {total_lines} | Размер: {size_kb} КБ"))
+            self.gcode_stats_var.set(f"Строк: {total_lines} | Размер: {size_kb} КБ | Режим: {mode}")
+            self.stats_var.set(f"Строк: {total_lines} | Размер: {size_kb} КБ")
         except Exception as e:
-            error_msg = f"Ошибка генерации G-кода:\n{str(e)}"
-            self.root.after(0, lambda: messagebox.showerror("Ошибка генерации", error_msg))
-            self.root.after(0, lambda: self.status_var.set("Ошибка генерации G-кода"))
-            self.root.after(0, lambda: self.stats_var.set(""))
+            messagebox.showerror("Ошибка генерации", f"Ошибка генерации G-кода:\n{str(e)}")
+            self.status_var.set("Ошибка генерации G-кода")
+            self.stats_var.set("")
         finally:
-            self.root.after(0, self._finish_gcode_generation)
+            self._finish_gcode_generation()
             
-    def _update_gcode_display(self):
+    def _clear_gcode_text(self):
+        if self._gcode_insert_job is not None:
+            self.root.after_cancel(self._gcode_insert_job)
+            self._gcode_insert_job = None
         self.gcode_text.delete(1.0, tk.END)
-        self.gcode_text.insert(tk.END, self.gcode)
+        
+    def _update_gcode_display(self):
+        self._clear_gcode_text()
+        self._gcode_shown = 0
+        self._show_more_gcode()
+        
+    def _show_more_gcode(self):
+        # Большой G-код показываем страницами по GCODE_DISPLAY_LINES строк:
+        # вставка мегабайт текста в Text очень медленная, следующая страница
+        # подгружается при прокрутке до конца
+        start = self._gcode_shown
+        end = start - 1
+        for _ in range(self.GCODE_DISPLAY_LINES):
+            end = self.gcode.find("\n", end + 1)
+            if end < 0:
+                break
+        stop = len(self.gcode) if end < 0 else end + 1
+        self._gcode_shown = stop
+        note = ""
+        if stop < len(self.gcode):
+            hidden = self.gcode.count("\n", stop) + (not self.gcode.endswith("\n"))
+            note = f"; ... ещё {hidden} строк (прокрутите вниз, чтобы показать)\n"
+        if self.gcode_text.tag_ranges("more"):
+            self.gcode_text.delete("more.first", "more.last")
+        self._insert_gcode_chunk(self.gcode[start:stop], 0, note)
+        
+    def _insert_gcode_chunk(self, text, start, note=""):
+        # Вставляем порциями, чтобы между ними обрабатывались события окна
+        stop = start + self.GCODE_INSERT_CHUNK
+        self.gcode_text.insert(tk.END, text[start:stop])
+        if stop < len(text):
+            self._gcode_insert_job = self.root.after(1, self._insert_gcode_chunk, text, stop, note)
+        else:
+            self._gcode_insert_job = None
+            if note:
+                self.gcode_text.insert(tk.END, note, "more")
+                
+    def _on_gcode_scroll(self, first, last):
+        self.gcode_text.vbar.set(first, last)
+        if float(last) >= 1.0 and self._gcode_insert_job is None and self.gcode_text.tag_ranges("more"):
+            self._show_more_gcode()
         
     def _finish_gcode_generation(self):
         self.processing = False
@@ -934,12 +1362,19 @@ class ImageToGCodeApp:
         if devices:
             self.device_combo.current(0)
             self.device_combo.config(state="readonly")
+            self.on_device_selected(None)
         else:
             self.device_combo.set("Устройства не найдены")
             self.device_combo.config(state="disabled")
             
     def on_device_selected(self, event):
-        pass  
+        # Для порта, где прошивка уже отвечала, подставляется проверенная скорость
+        if self.connection_type_var.get() != "serial":
+            return
+        devices = self.connection_manager.get_available_devices("serial")
+        device_index = self.device_combo.current()
+        if 0 <= device_index < len(devices):
+            self.baud_combo.set(self.connection_manager.serial_conn.preferred_baudrate(devices[device_index]['id']))
         
     def toggle_connection(self):
         if self.is_connected:
@@ -958,7 +1393,8 @@ class ImageToGCodeApp:
         
         if device_index >= 0 and device_index < len(devices):
             device_id = devices[device_index]['id']
-            success, message = self.connection_manager.connect(device_id, connection_type)
+            baudrate = int(self.baud_combo.get())
+            success, message = self.connection_manager.connect(device_id, connection_type, baudrate)
             
             if success:
                 self.is_connected = True
@@ -1,5 +1,6 @@
 import numpy as np
-from typing import List, Tuple, Dict, Optional, Protocol, runtime_checkable
+from functools import lru_cache
+from typing import List, Tuple, Dict, Optional, Iterator, TextIO
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
@@ -26,6 +27,9 @@ CYRILLIC_WIDTHS = {
     '"': 10, "'": 4, '№': 20, '—': 16, '…': 10,
 }
 
+# Короче этого строка быстрее меряется обычным циклом, чем через NumPy
+VECTOR_WIDTH_MIN_CHARS = 200
+
 class TextAlignment(Enum):
     LEFT = "left"
     CENTER = "center"
@@ -62,6 +66,7 @@ class HersheyFont(FontRenderer):
         self.spacing = spacing
         self.line_height = line_height
         self.char_widths = {}
+        self._path_cache = {}
         self._init_metrics()
     
     def _init_metrics(self):
@@ -80,8 +85,8 @@ class HersheyFont(FontRenderer):
             char_widths=self.char_widths
         )
     
-    def _scale_points(self, points: List[Tuple[int, int]]) -> List[Tuple[float, float]]:
-        return [(x * self.scale, y * self.scale) for x, y in points]
+    def _scale_points(self, points: List[Tuple[int, int]]) -> np.ndarray:
+        return np.asarray(points, dtype=np.float64) * self.scale
     
     def _get_fallback_char(self, char: str) -> str:
         fallbacks = {
@@ -101,7 +106,14 @@ class CyrillicHersheyFont(HersheyFont):
         from hershey_cyrillic import HERSHEY_CYRILLIC_CALLIGRAPHIC
         return HERSHEY_CYRILLIC_CALLIGRAPHIC
     
-    def get_character_path(self, char: str) -> List[List[Tuple[float, float]]]:
+    def get_character_path(self, char: str) -> List[np.ndarray]:
+        # Масштаб шрифта не меняется после создания, поэтому пути символов кэшируются
+        path = self._path_cache.get(char)
+        if path is None:
+            path = self._path_cache[char] = self._build_character_path(char)
+        return path
+    
+    def _build_character_path(self, char: str) -> List[np.ndarray]:
         char_to_use = char
         if char not in self.font_dict:
             char_to_use = self._get_fallback_char(char)
@@ -122,44 +134,75 @@ class TextLayoutEngine:
     def __init__(self, font: FontRenderer):
         self.font = font
         self.metrics = font.get_metrics()
+        self._layout_key = None
+        self._layout_result = None
     
     def layout_text(self, text: str, start_x: float = 0, start_y: float = 0,
-                   max_width: Optional[float] = None) -> List[List[Tuple[float, float]]]:
+                   max_width: Optional[float] = None) -> List[np.ndarray]:
+        return self.layout_and_measure(text, start_x, start_y, max_width)[0]
+    
+    def layout_and_measure(self, text: str, start_x: float = 0, start_y: float = 0,
+                           max_width: Optional[float] = None) -> Tuple[List[np.ndarray], float, float]:
+        # Раскладка и размер считаются за один проход, последний результат запоминается
+        key = (text, start_x, start_y, max_width)
+        if key == self._layout_key:
+            return self._layout_result
+        
         all_lines = []
         x_offset = start_x
         y_offset = start_y
+        text_width = 0
         
         text_lines = text.split('\n') if '\n' in text else [text]
+        line_count = len(text_lines)
         
         for line in text_lines:
             x_offset = start_x
+            line_width = 0
             words = line.split(' ')
+            # Перенос проверяется по целым словам: ширины слов считаются один раз
+            word_widths = [self._calculate_line_width(word) for word in words] if max_width else None
             
             for i, word in enumerate(words):
+                wrap = False
                 if i > 0:
                     space_width = self.font.get_character_width(' ')
-                    if max_width and (x_offset + space_width) > (start_x + max_width):
-                        self._new_line(y_offset, start_x)
-                        y_offset = self._new_line(y_offset, start_x)
+                    if max_width and (x_offset + space_width + word_widths[i]) > (start_x + max_width):
+                        wrap = True
                     else:
                         x_offset += space_width
+                        line_width += space_width
+                # Слово шире всей строки переносится посимвольно
+                char_wrap = bool(max_width) and word_widths[i] > max_width
                 
                 for char in word:
                     char_width = self.font.get_character_width(char)
+                    if (char_wrap and x_offset > start_x
+                            and x_offset + char_width * self.metrics.spacing > start_x + max_width):
+                        wrap = True
                     
-                    if max_width and (x_offset + char_width) > (start_x + max_width):
+                    if wrap:
+                        text_width = max(text_width, line_width)
+                        line_count += 1
                         y_offset = self._new_line(y_offset, start_x)
+                        x_offset = start_x
+                        line_width = 0
+                        wrap = False
                     
                     char_paths = self.font.get_character_path(char)
                     for path in char_paths:
-                        offset_path = [(x + x_offset, y + y_offset) for x, y in path]
-                        all_lines.append(offset_path)
+                        all_lines.append(np.asarray(path, dtype=np.float64) + (x_offset, y_offset))
                     
                     x_offset += char_width * self.metrics.spacing
+                    line_width += char_width * self.metrics.spacing
             
+            text_width = max(text_width, line_width)
             y_offset = self._new_line(y_offset, start_x)
         
-        return all_lines
+        text_height = self.metrics.base_height * line_count * self.metrics.line_height
+        self._layout_key = key
+        self._layout_result = (all_lines, text_width, text_height)
+        return self._layout_result
     
     def _new_line(self, current_y: float, start_x: float) -> float:
         return current_y - self.metrics.base_height * self.metrics.line_height
@@ -177,29 +220,41 @@ class TextLayoutEngine:
         return (max_width, height)
     
     def _calculate_line_width(self, line: str) -> float:
-        width = 0
-        words = line.split(' ')
-        
-        for i, word in enumerate(words):
-            if i > 0:
-                width += self.font.get_character_width(' ')
+        if len(line) < VECTOR_WIDTH_MIN_CHARS:
+            width = 0
+            words = line.split(' ')
             
-            for char in word:
-                width += self.font.get_character_width(char) * self.metrics.spacing
+            for i, word in enumerate(words):
+                if i > 0:
+                    width += self.font.get_character_width(' ')
+                
+                for char in word:
+                    width += self.font.get_character_width(char) * self.metrics.spacing
+            
+            return width
         
-        return width
+        # Для длинных строк ширина ищется один раз на каждый различный символ;
+        # cumsum складывает последовательно, как и посимвольный цикл
+        codes = np.frombuffer(line.encode('utf-32-le'), dtype=np.uint32)
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        unique_widths = np.array([
+            self.font.get_character_width(' ') if code == 32
+            else self.font.get_character_width(chr(code)) * self.metrics.spacing
+            for code in unique_codes.tolist()
+        ], dtype=np.float64)
+        return float(np.cumsum(unique_widths[inverse])[-1])
 
 class TextToContoursConverter:
     
     @staticmethod
-    def convert(text_paths: List[List[Tuple[float, float]]]) -> List[np.ndarray]:
+    def convert(text_paths: List[np.ndarray]) -> List[np.ndarray]:
         contours = []
         
         for path in text_paths:
             if len(path) < 2:
                 continue
             
-            contour = np.array([[[int(x), int(y)]] for x, y in path], dtype=np.int32)
+            contour = np.asarray(path, dtype=np.float64).astype(np.int32).reshape(-1, 1, 2)
             contours.append(contour)
         
         return contours
@@ -210,81 +265,76 @@ class TextGCodeGenerator:
         self.font = font
         self.config = config
         self.metrics = font.get_metrics()
+        self.layout_engine = TextLayoutEngine(font)
     
     def generate(self, text: str, start_x: float = 0, start_y: float = 0,
-                align: TextAlignment = TextAlignment.LEFT) -> str:
-        start_x = self._adjust_position_for_alignment(text, start_x, align)
-        
-        layout_engine = TextLayoutEngine(self.font)
-        text_paths = layout_engine.layout_text(
-            text, 
-            start_x / self.metrics.base_width, 
-            start_y / self.metrics.base_height
-        )
+                align: TextAlignment = TextAlignment.LEFT,
+                out: Optional[TextIO] = None) -> Optional[str]:
+        text_paths, start_x = self._layout_aligned(text, start_x, start_y, align)
+        lines = self._iter_gcode(text_paths, text, start_x, start_y, align)
+        if out is None:
+            return "\n".join(lines)
         
-        return self._build_gcode(text_paths, text, start_x, start_y, align)
+        # Строки пишутся в поток по одной, без промежуточного списка
+        out.write(next(lines))
+        for line in lines:
+            out.write("\n")
+            out.write(line)
+        return None
     
-    def _adjust_position_for_alignment(self, text: str, start_x: float, 
-                                      align: TextAlignment) -> float:
+    def _layout_aligned(self, text: str, start_x: float, start_y: float,
+                        align: TextAlignment) -> Tuple[List[np.ndarray], float]:
+        y = start_y / self.metrics.base_height
         if align == TextAlignment.LEFT:
-            return start_x
+            return self.layout_engine.layout_and_measure(text, start_x / self.metrics.base_width, y)[0], start_x
         
-        layout_engine = TextLayoutEngine(self.font)
-        text_width, _ = layout_engine.calculate_text_size(text)
+        # Ширина берётся из той же раскладки, текст лишь сдвигается по X
+        paths, text_width, _ = self.layout_engine.layout_and_measure(text, 0, y)
         text_width_mm = text_width * self.metrics.base_width
         
         if align == TextAlignment.CENTER:
-            return start_x - text_width_mm / 2
+            start_x -= text_width_mm / 2
         elif align == TextAlignment.RIGHT:
-            return start_x - text_width_mm
-        return start_x
+            start_x -= text_width_mm
+        
+        shift = (start_x / self.metrics.base_width, 0)
+        return [path + shift for path in paths], start_x
     
-    def _build_gcode(self, text_paths: List[List[Tuple[float, float]]], 
+    def _iter_gcode(self, text_paths: List[np.ndarray], 
                     text: str, start_x: float, start_y: float, 
-                    align: TextAlignment) -> str:
-        gcode_lines = []
+                    align: TextAlignment) -> Iterator[str]:
         pen_up = True
         
-        gcode_lines.extend([
-            "; === РУССКИЙ ТЕКСТ ===",
-            f"; Текст: {text}",
-            f"; Позиция: X={start_x:.2f}mm Y={start_y:.2f}mm",
-            f"; Масштаб: {self.metrics.base_width:.2f}, Выравнивание: {align.value}",
-            "",
-            "G21 ; мм",
-            "G90 ; абсолютные координаты",
-            f"G0 Z{self.config['pen_up_z']:.2f} F{self.config['rapid_feed_rate']}"
-        ])
+        yield "; === РУССКИЙ ТЕКСТ ==="
+        yield f"; Текст: {text}"
+        yield f"; Позиция: X={start_x:.2f}mm Y={start_y:.2f}mm"
+        yield f"; Масштаб: {self.metrics.base_width:.2f}, Выравнивание: {align.value}"
+        yield ""
+        yield "G21 ; мм"
+        yield "G90 ; абсолютные координаты"
+        yield f"G0 Z{self.config['pen_up_z']:.2f} F{self.config['rapid_feed_rate']}"
+        
+        pen_up_cmd = f"G0 Z{self.config['pen_up_z']:.2f}"
+        pen_down_cmd = f"G1 Z{self.config['pen_down_z']:.2f} F{self.config['feed_rate']}"
+        rapid_fmt = ("G0 X{:.2f} Y{:.2f} F" + str(self.config['rapid_feed_rate'])).format
+        feed_fmt = ("G1 X{:.2f} Y{:.2f} F" + str(self.config['feed_rate'])).format
+        scale = np.array([self.metrics.base_width, self.metrics.base_height])
         
         for path in text_paths:
-            if not path:
+            if not len(path):
                 continue
             
-            for i, (x, y) in enumerate(path):
-                x_mm = x * self.metrics.base_width
-                y_mm = y * self.metrics.base_height
-                
-                if i == 0:
-                    if not pen_up:
-                        gcode_lines.append(f"G0 Z{self.config['pen_up_z']:.2f}")
-                        pen_up = True
-                    
-                    gcode_lines.append(
-                        f"G0 X{x_mm:.2f} Y{y_mm:.2f} F{self.config['rapid_feed_rate']}"
-                    )
-                    gcode_lines.append(
-                        f"G1 Z{self.config['pen_down_z']:.2f} F{self.config['feed_rate']}"
-                    )
-                    pen_up = False
-                else:
-                    gcode_lines.append(
-                        f"G1 X{x_mm:.2f} Y{y_mm:.2f} F{self.config['feed_rate']}"
-                    )
+            points_mm = (path * scale).tolist()
+            if not pen_up:
+                yield pen_up_cmd
+            yield rapid_fmt(*points_mm[0])
+            yield pen_down_cmd
+            pen_up = False
+            for x_mm, y_mm in points_mm[1:]:
+                yield feed_fmt(x_mm, y_mm)
         
         if not pen_up:
-            gcode_lines.append(f"G0 Z{self.config['pen_up_z']:.2f} F{self.config['rapid_feed_rate']}")
-        
-        return "\n".join(gcode_lines)
+            yield f"{pen_up_cmd} F{self.config['rapid_feed_rate']}"
 
 class TextComposer:
  
@@ -299,25 +349,28 @@ class TextComposer:
         if not text.strip():
             return existing_contours
         
-        text_pos = self._calculate_text_position(existing_contours, position, text, align)
+        text_x, text_y = self._calculate_text_position(existing_contours, position, text, align)
         
-        layout_engine = TextLayoutEngine(self.font)
-        text_paths = layout_engine.layout_text(
-            text, 
-            text_pos[0] / self.metrics.base_width, 
-            text_pos[1] / self.metrics.base_height
-        )
-        
-        converter = TextToContoursConverter()
-        text_contours = converter.convert(text_paths)
+        # Раскладка текста кэшируется в начале координат и только сдвигается
+        points, lengths = self._layout_at_origin(text)
+        if not lengths:
+            return list(existing_contours)
         
-        return existing_contours + text_contours
+        offset = np.array([text_x / self.metrics.base_width, text_y / self.metrics.base_height])
+        shifted = (points + offset).astype(np.int32).reshape(-1, 1, 2)
+        return existing_contours + np.split(shifted, np.cumsum(lengths)[:-1])
+    
+    def _layout_at_origin(self, text: str) -> Tuple[np.ndarray, Tuple[int, ...]]:
+        font = self.font
+        if isinstance(font, CyrillicHersheyFont) and font.font_dict is font._load_default_font():
+            return _cyrillic_layout_at_origin(text, font.scale, font.spacing, font.line_height)
+        return _pack_paths(TextLayoutEngine(font).layout_text(text))
     
     def _calculate_text_position(self, contours: List[np.ndarray], 
                                position: Tuple[float, float], text: str,
                                align: TextAlignment) -> Tuple[float, float]:
         if contours:
-            all_points = np.vstack([c.reshape(-1, 2) for c in contours if len(c) > 0])
+            all_points = np.concatenate([c.reshape(-1, 2) for c in contours])
             min_x, min_y = all_points.min(axis=0)
             max_x, max_y = all_points.max(axis=0)
             
@@ -343,7 +396,8 @@ class TextComposer:
 
 def text_to_gcode_cyrillic(text: str, config: dict, 
                           start_x: float = 0, start_y: float = 0,
-                          align: str = 'left') -> str:
+                          align: str = 'left',
+                          out: Optional[TextIO] = None) -> Optional[str]:
     try:
         alignment = TextAlignment(align.lower())
     except ValueError:
@@ -355,7 +409,7 @@ def text_to_gcode_cyrillic(text: str, config: dict,
     font = CyrillicHersheyFont(scale=font_scale, spacing=font_spacing)
     generator = TextGCodeGenerator(font, config)
     
-    return generator.generate(text, start_x, start_y, alignment)
+    return generator.generate(text, start_x, start_y, alignment, out)
 
 def add_cyrillic_text_to_contours(text: str, contours: List[np.ndarray], config: dict, 
                                  position: Tuple[float, float] = (0.5, 0.5),
@@ -367,6 +421,20 @@ def add_cyrillic_text_to_contours(text: str, contours: List[np.ndarray], config:
     
     font_scale = config.get("font_scale", 0.15)
     font = CyrillicHersheyFont(scale=font_scale)
-    
     composer = TextComposer(font, config)
-    return composer.add_text(text, contours, position, alignment)
\ No newline at end of file
+    return composer.add_text(text, contours, position, alignment)
+
+@lru_cache(maxsize=32)
+def _cyrillic_layout_at_origin(text: str, scale: float, spacing: float,
+                               line_height: float) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    font = CyrillicHersheyFont(scale=scale, spacing=spacing, line_height=line_height)
+    return _pack_paths(TextLayoutEngine(font).layout_text(text))
+
+def _pack_paths(text_paths: List[np.ndarray]) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    paths = [path for path in text_paths if len(path) >= 2]
+    if not paths:
+        return np.empty((0, 2)), ()
+    
+    points = np.concatenate(paths)
+    points.setflags(write=False)
+    return points, tuple(len(path) for path in paths)
\ No newline at end of file
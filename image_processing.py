@@ -1,9 +1,16 @@
 import cv2
 import numpy as np
 import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Tuple, List, Optional
 from config import DEFAULT_CONFIG
 
+HATCH_BLOCK_ROWS = 32
+OPENCL_MIN_PIXELS = 512 * 512
+
+_HATCH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
 def preprocess_image(img: np.ndarray) -> np.ndarray:
     if img is None or img.size == 0:
         raise ValueError("Получено пустое изображение")
@@ -14,7 +21,43 @@ def preprocess_image(img: np.ndarray) -> np.ndarray:
         else:
             img = img.astype(np.uint8)
     
-    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img.copy()
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+
+def limit_image_size(img: np.ndarray, max_size: int) -> np.ndarray:
+    height, width = img.shape[:2]
+    factor = max_size / max(height, width)
+    if factor >= 1.0:
+        return img
+    
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def scale_contours(contours: List[np.ndarray], scale_x: float, scale_y: float) -> List[np.ndarray]:
+    scale = np.array([scale_x, scale_y])
+    return [np.rint(cnt * scale).astype(np.int32) for cnt in contours]
+
+def pack_lines(lines: List[np.ndarray], dtype=np.int32) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter((len(line) for line in lines), dtype=np.int32, count=len(lines))
+    if not lines:
+        return np.empty((0, 2), dtype=dtype), lengths
+    points = np.concatenate([np.asarray(line, dtype=dtype).reshape(-1, 2) for line in lines])
+    return points, lengths
+
+def unpack_lines(points: np.ndarray, lengths: np.ndarray) -> List[np.ndarray]:
+    if lengths.size == 0:
+        return []
+    return np.split(points, np.cumsum(lengths[:-1]))
+
+def scale_lines(lines: List[np.ndarray], scale_x: float, scale_y: float) -> List[np.ndarray]:
+    points, lengths = pack_lines(lines, np.float64)
+    points *= (scale_x, scale_y)
+    return unpack_lines(points, lengths)
+
+@lru_cache(maxsize=16)
+def _get_morph_kernel(size: int) -> np.ndarray:
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    kernel.setflags(write=False)
+    return kernel
 
 def get_contours(
     img: np.ndarray,
@@ -30,17 +73,24 @@ def get_contours(
     gray = preprocess_image(img)
     min_contour_length = min_contour_length or DEFAULT_CONFIG["min_contour_length"]
 
+    # Большие изображения фильтруются через OpenCL (UMat), если он доступен;
+    # findContours работает только на CPU, поэтому края выгружаются перед ним
+    if gray.size >= OPENCL_MIN_PIXELS and cv2.ocl.useOpenCL():
+        gray = cv2.UMat(gray)
+
     blurred = cv2.GaussianBlur(gray, (blur_kernel, blur_kernel), blur_sigma)
     
     edges = cv2.Canny(blurred, canny_min, canny_max)
     
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (morph_kernel_size, morph_kernel_size))
+    kernel = _get_morph_kernel(morph_kernel_size)
     edges = cv2.morphologyEx(
         edges, 
         cv2.MORPH_CLOSE, 
         kernel, 
         iterations=morph_iterations
     )
+    if isinstance(edges, cv2.UMat):
+        edges = edges.get()
 
     contours, _ = cv2.findContours(
         edges, 
@@ -56,48 +106,107 @@ def get_contours(
     return edges, filtered_contours
 
 def _generate_hatch_direction(
-    lines: List[List[Tuple[int, int]]],
-    img: np.ndarray,
-    angle: float,
+    segments: List[np.ndarray],
+    mask: np.ndarray,
+    cos_a: float,
+    sin_a: float,
     spacing: int,
     height: int,
     width: int,
     min_line_length: int
 ) -> None:
 
-    angle_rad = math.radians(angle)
     diag = int(math.sqrt(height**2 + width**2))
     
-    for i in range(-diag, diag, spacing):
-        current_line = []
-        last_brightness = 0
+    # Штрихуемые пиксели лежат в своем ограничивающем прямоугольнике:
+    # участки сканирующих линий вне него можно не рассматривать
+    rows_any = np.flatnonzero(mask.any(axis=1))
+    if not len(rows_any):
+        return
+    cols_any = np.flatnonzero(mask.any(axis=0))
+    
+    t = np.arange(-diag, diag, dtype=np.float64)
+    t_sin = t * sin_a
+    t_cos = t * cos_a
+    offsets = np.arange(-diag, diag, spacing, dtype=np.float64)
+    lo, hi = _scanline_window(
+        offsets, cos_a, sin_a,
+        cols_any[0] - 2, cols_any[-1] + 2, rows_any[0] - 2, rows_any[-1] + 2
+    )
+    lo = np.clip(np.floor(lo) + diag, 0, len(t)).astype(np.intp)
+    hi = np.clip(np.ceil(hi) + diag + 1, 0, len(t)).astype(np.intp)
+    
+    # Сканирующие линии обрабатываются блоками по HATCH_BLOCK_ROWS как двумерные
+    # массивы; столбцы блока ограничены объединением окон его линий
+    for first in range(0, len(offsets), HATCH_BLOCK_ROWS):
+        block = slice(first, first + HATCH_BLOCK_ROWS)
+        used = lo[block] < hi[block]
+        if not used.any():
+            continue
+        c0 = lo[block][used].min()
+        c1 = hi[block][used].max()
+        row_len = c1 - c0 + 2
+        
+        i = offsets[block, None]
+        # Точки сканирующих линий, округление как int(v + 0.5). Для углов, кратных 90°,
+        # одно из слагаемых нулевое: каждая координата зависит только от строки
+        # или только от t, и считается одномерным массивом
+        if sin_a == 0.0:
+            x = (i * cos_a + 0.5).astype(np.int32)
+            y = (t_cos[None, c0:c1] + 0.5).astype(np.int32)
+        elif cos_a == 0.0:
+            x = (0.5 - t_sin[None, c0:c1]).astype(np.int32)
+            y = (i * sin_a + 0.5).astype(np.int32)
+        else:
+            x = (i * cos_a - t_sin[c0:c1] + 0.5).astype(np.int32)
+            y = (i * sin_a + t_cos[c0:c1] + 0.5).astype(np.int32)
+        
+        # Отрицательные значения при беззнаковом сравнении становятся большими,
+        # поэтому на каждую ось хватает одной проверки
+        inside = (x.view(np.uint32) < width) & (y.view(np.uint32) < height)
+        if not inside.any():
+            continue
+        x, y = np.broadcast_arrays(x, y)
         
-        for t in range(-diag, diag):
-            x = int(i * math.cos(angle_rad) - t * math.sin(angle_rad) + 0.5)
-            y = int(i * math.sin(angle_rad) + t * math.cos(angle_rad) + 0.5)
-            
-            if 0 <= x < width and 0 <= y < height:
-                brightness = img[y, x]
-                threshold = 180 - brightness // 2
-                
-                if brightness > threshold:
-                    if not current_line or last_brightness <= threshold:
-                        current_line = [(x, y)]
-                    else:
-                        current_line.append((x, y))
-                elif current_line:
-                    if len(current_line) > min_line_length:
-                        lines.append(current_line)
-                    current_line = []
-                
-                last_brightness = brightness
-            elif current_line:
-                if len(current_line) > min_line_length:
-                    lines.append(current_line)
-                current_line = []
+        # Пустые столбцы по краям не дают участкам переходить на соседнюю строку
+        bright = np.zeros((len(i), row_len), dtype=bool)
+        bright[:, 1:-1][inside] = mask[y[inside], x[inside]]
         
-        if current_line and len(current_line) > min_line_length:
-            lines.append(current_line)
+        # Непрерывные участки светлых пикселей становятся отрезками штриховки:
+        # все точки участка лежат на одной прямой, поэтому хранятся только концы
+        edges = np.diff(bright.ravel().view(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        keep = ends - starts > min_line_length
+        if keep.any():
+            starts, last = starts[keep], ends[keep] - 1
+            rows, cols = np.divmod(starts, row_len)
+            last_cols = last - rows * row_len
+            segments.append(np.column_stack((
+                x[rows, cols], y[rows, cols], x[rows, last_cols], y[rows, last_cols]
+            )))
+
+def _scanline_window(
+    offsets: np.ndarray,
+    cos_a: float,
+    sin_a: float,
+    x0: float, x1: float, y0: float, y1: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Диапазон параметра t, при котором точка (i*cos - t*sin, i*sin + t*cos)
+    # попадает в прямоугольник [x0, x1] x [y0, y1]
+    lo = np.full(len(offsets), -np.inf)
+    hi = np.full(len(offsets), np.inf)
+    if abs(sin_a) > 1e-9:
+        a = (offsets * cos_a - x1) / sin_a
+        b = (offsets * cos_a - x0) / sin_a
+        lo = np.maximum(lo, np.minimum(a, b))
+        hi = np.minimum(hi, np.maximum(a, b))
+    if abs(cos_a) > 1e-9:
+        a = (y0 - offsets * sin_a) / cos_a
+        b = (y1 - offsets * sin_a) / cos_a
+        lo = np.maximum(lo, np.minimum(a, b))
+        hi = np.minimum(hi, np.maximum(a, b))
+    return lo, hi
 
 def generate_hatching(
     img: np.ndarray,
@@ -105,27 +214,47 @@ def generate_hatching(
     angle: float = 45.0,
     cross_hatch: bool = False,
     min_line_length: Optional[int] = None
-) -> List[List[Tuple[int, int]]]:
+) -> List[np.ndarray]:
 
     min_line_length = min_line_length or DEFAULT_CONFIG["min_line_length"]
     
     if img is None or img.size == 0:
         raise ValueError("Пустое изображение для генерации штриховки")
     
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img.copy()
-    normalized = 255 - gray
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+    # b > 180 - b // 2 для целых b равносильно b > 120, а для b = 255 - gray это
+    # gray < 135: маска считается одним сравнением без промежуточной копии
+    mask = gray < 135
     
     height, width = gray.shape
     line_spacing = max(2, 100 // density)
-    lines = []
+    segments = []
     
-    _generate_hatch_direction(
-        lines, normalized, angle, line_spacing, height, width, min_line_length
-    )
+    angle_rad = math.radians(angle)
+    cos_a = math.cos(angle_rad)
+    sin_a = math.sin(angle_rad)
+    if angle % 90 == 0:
+        # cos(90°) вычисляется как 6e-17: точные значения включают быстрый путь
+        cos_a, sin_a = float(round(cos_a)), float(round(sin_a))
     
+    cross_segments = []
+    cross = None
     if cross_hatch:
-        _generate_hatch_direction(
-            lines, normalized, angle + 90, line_spacing, height, width, min_line_length
+        # Второе направление считается параллельно: NumPy отпускает GIL в своих циклах.
+        # Поворот на 90°: cos(a + 90) = -sin(a), sin(a + 90) = cos(a)
+        cross = _HATCH_EXECUTOR.submit(
+            _generate_hatch_direction,
+            cross_segments, mask, -sin_a, cos_a, line_spacing, height, width, min_line_length
         )
+    _generate_hatch_direction(
+        segments, mask, cos_a, sin_a, line_spacing, height, width, min_line_length
+    )
+    if cross is not None:
+        cross.result()
+        segments.extend(cross_segments)
+    
+    if not segments:
+        return []
     
-    return lines
\ No newline at end of file
+    # Один буфер (M, 4) [x1, y1, x2, y2]; линии - двухточечные представления в нём
+    return list(np.concatenate(segments).reshape(-1, 2, 2))
\ No newline at end of file
@@ -20,11 +20,11 @@ def main():
     root.minsize(1000, 700)
     
     def on_closing():
-        if app.processing:
-            if messagebox.askokcancel("Закрытие", "Обработка еще выполняется. Закрыть программу?"):
-                root.destroy()
-        else:
-            root.destroy()
+        if app.processing and not messagebox.askokcancel("Закрытие", "Обработка еще выполняется. Закрыть программу?"):
+            return
+        app.connection_manager.close()
+        app.shutdown()
+        root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
     
@@ -4,14 +4,27 @@ import threading
 import time
 import asyncio
 import logging
-from datetime import datetime
+import queue
+import select
+from collections import deque
 from bleak import BleakScanner, BleakClient
 import os
 
+# Служебные команды не меняются между отправками: байты для них готовятся один раз
+_INIT_COMMANDS = ("M110 N0", "G90", "G21")
+_END_COMMANDS = ("G0 X0 Y0 F1500", "M30")
+_INIT_BYTES = tuple(f"{cmd}\n".encode('utf-8') for cmd in _INIT_COMMANDS)
+_END_BYTES = tuple(f"{cmd}\n".encode('utf-8') for cmd in _END_COMMANDS)
+_EMERGENCY_BYTES = (b'\x18', b'!\n', b'M112\n', b'M0\n', b'M5\n', b'M999\n')
+_BLE_EMERGENCY_BYTES = (b'M112\n', b'!\n', b'\x18', b'M5\n')
+
 class Connection:
     def __init__(self, gui_app=None):
         self.gui_app = gui_app
         self.is_connected = False
+        # Обработчики GUI находятся один раз, а не проверяются на каждое сообщение
+        self._status_callback = getattr(gui_app, 'update_status_message', None)
+        self._connection_callback = getattr(gui_app, 'update_connection_status', None)
         self.setup_logger()
     
     def setup_logger(self):
@@ -23,26 +36,65 @@ class Connection:
         self.logger = logging.getLogger(self.__class__.__name__)
     
     def update_gui_status(self, message, success=True):
-        if hasattr(self.gui_app, 'update_status_message'):
-            self.gui_app.root.after(0, lambda: self.gui_app.update_status_message(message))
+        if self._status_callback is not None:
+            self.gui_app.root.after(0, self._status_callback, message)
     
     def update_gui_connection_status(self, status_text, is_connected):
-        if hasattr(self.gui_app, 'update_connection_status'):
-            self.gui_app.root.after(0, lambda: self.gui_app.update_connection_status(status_text, is_connected))
+        if self._connection_callback is not None:
+            self.gui_app.root.after(0, self._connection_callback, status_text, is_connected)
+    
+    @staticmethod
+    def _program_lines(lines):
+        # Пустые строки и комментарии отбрасываются до отправки
+        for i, line in enumerate(lines, 1):
+            line = line.strip()
+            if line and not line.startswith((';', '(')):
+                yield i, line
 
 class SerialConnection(Connection):
+    # Размер приемного буфера типичной прошивки (GRBL - 128 байт)
+    SEND_CHUNK_BYTES = 128
+    # Пауза на строку, если устройство не отвечает "ok" (прежний темп отправки)
+    ACK_WAIT_SECONDS = 0.03
+    # Сколько ждать "ok" от отвечающего устройства, прежде чем прервать передачу. С запасом:
+    # при полном буфере планировщика ответ задерживается на время длинного медленного хода.
+    # Строку не считаем принятой наугад - лишние байты переполнили бы приемный буфер устройства
+    ACK_TIMEOUT_SECONDS = 10.0
+    # Сколько живет список портов: частые обновления GUI не пересканируют систему
+    PORTS_CACHE_SECONDS = 0.5
+    SUPPORTED_BAUDS = (9600, 57600, 115200, 230400, 250000, 460800, 921600)
+    DEFAULT_BAUDRATE = 115200
+    # Прошивки, которые узнаются по строке приветствия/ответу M115
+    FIRMWARE_NAMES = ("Marlin", "Grbl")
+    
     def __init__(self, gui_app=None):
         super().__init__(gui_app)
         self.serial_connection = None
-        self.receive_queue = []
+        self.receive_queue = deque(maxlen=20)
+        self.receive_lock = threading.Lock()
         self.receive_thread = None
         self.send_thread = None
         self.stop_receive = threading.Event()
         self.stop_send = threading.Event()  
-        self.send_queue = []
         self.send_lock = threading.Lock()
+        self._ack_cond = threading.Condition()
+        self._ack_count = 0
+        self._acks_seen = False
+        self._rx_tail = b""
+        self._wake_pipe = None
+        self._send_error = None
+        self._ports_cache = (0.0, [])
+        self.baudrate = self.DEFAULT_BAUDRATE
+        self.port_name = None
+        self.detected_firmware = None
+        # Порт -> скорость, на которой прошивка ответила осмысленным текстом
+        self.port_baudrates = {}
     
     def get_available_ports(self):
+        cached_at, cached_ports = self._ports_cache
+        if cached_ports and time.monotonic() - cached_at < self.PORTS_CACHE_SECONDS:
+            return list(cached_ports)
+        
         ports = []
         try:
             available_ports = serial.tools.list_ports.comports()
@@ -52,24 +104,31 @@ class SerialConnection(Connection):
                     'name': f"{port.device} - {port.description.split(' (')[0]}"
                 })
             self.logger.info(f"Найдено последовательных портов: {len(ports)}")
-            return ports
+            self._ports_cache = (time.monotonic(), ports)
+            return list(ports)
         except Exception as e:
             self.logger.error(f"Ошибка при получении списка портов: {e}")
             return []
     
-    def connect(self, port_name):
+    def connect(self, port_name, baudrate=DEFAULT_BAUDRATE):
         try:
             if self.is_connected:
                 self.disconnect()
                 
-            self.logger.info(f"Попытка подключения к {port_name} с baudrate=115200")
+            self.logger.info(f"Попытка подключения к {port_name} с baudrate={baudrate}")
+            self._ports_cache = (0.0, [])
             
             self.stop_receive.clear()
             self.stop_send.clear()
+            self._acks_seen = False
+            self._rx_tail = b""
+            self.baudrate = baudrate
+            self.port_name = port_name
+            self.detected_firmware = None
             
             self.serial_connection = serial.Serial(
                 port=port_name,
-                baudrate=115200,
+                baudrate=baudrate,
                 bytesize=serial.EIGHTBITS,
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
@@ -81,6 +140,8 @@ class SerialConnection(Connection):
                 self.is_connected = True
                 
                 self.stop_receive.clear()
+                if os.name != 'nt':
+                    self._wake_pipe = os.pipe()
                 self.receive_thread = threading.Thread(target=self._receive_data, daemon=True)
                 self.receive_thread.start()
                 
@@ -95,6 +156,7 @@ class SerialConnection(Connection):
                 return False, error_msg
                 
         except serial.SerialException as e:
+            self._ports_cache = (0.0, [])
             error_msg = f"Ошибка SerialException: {str(e)}"
             self.logger.error(error_msg)
             return False, error_msg
@@ -106,6 +168,8 @@ class SerialConnection(Connection):
     def disconnect(self):
         self.stop_send.set()
         self.stop_receive.set()
+        if self._wake_pipe:
+            os.write(self._wake_pipe[1], b"\0")
         
         if self.send_thread and self.send_thread.is_alive():
             self.send_thread.join(timeout=1.0)
@@ -113,8 +177,14 @@ class SerialConnection(Connection):
         if self.receive_thread and self.receive_thread.is_alive():
             self.receive_thread.join(timeout=1.0)
         
+        if self._wake_pipe:
+            for fd in self._wake_pipe:
+                os.close(fd)
+            self._wake_pipe = None
+        
         if self.serial_connection and self.serial_connection.is_open:
             try:
+                self.serial_connection.flush()
                 self.serial_connection.close()
                 self.logger.info("Соединение закрыто")
             except Exception as e:
@@ -123,7 +193,6 @@ class SerialConnection(Connection):
         prev_connected = self.is_connected
         self.is_connected = False
         self.serial_connection = None
-        self.send_queue.clear()
         
         if prev_connected:
             status_msg = "Отключено от последовательного порта"
@@ -133,29 +202,80 @@ class SerialConnection(Connection):
         return True, "Отключено"
     
     def _receive_data(self):
+        wait_readable = self._readable_waiter()
         while not self.stop_receive.is_set() and self.serial_connection and self.serial_connection.is_open:
             try:
-                if self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting)
+                if wait_readable():
+                    data = self.serial_connection.read(self.serial_connection.in_waiting or 1)
                     if data:
-                        decoded_data = data.decode('utf-8', errors='ignore').strip()
-                        if decoded_data:
-                            timestamp = datetime.now().strftime("%H:%M:%S")
-                            self.receive_queue.append(f"[{timestamp}] {decoded_data}")
-                            
-                            if len(self.receive_queue) > 20:
-                                self.receive_queue.pop(0)
-                            
-                            self.update_gui_status(decoded_data, True)
-                            self.logger.info(f"Получено: {decoded_data}")
+                        self._handle_received(data)
             
             except serial.SerialException:
+                self._ports_cache = (0.0, [])
                 self.logger.warning("Соединение разорвано")
                 break
             except Exception as e:
                 self.logger.error(f"Ошибка при чтении данных: {e}")
-            
-            time.sleep(0.05)
+                if self.stop_receive.wait(0.05):
+                    break
+    
+    def _readable_waiter(self):
+        # POSIX: поток спит в select до первого байта или до сигнала остановки через self-pipe,
+        # без периодических пробуждений; на Windows select не работает с портами,
+        # поэтому read(1) сам блокируется до прихода данных или таймаута порта
+        if os.name == 'nt' or not self._wake_pipe:
+            return lambda: True
+        fd = self.serial_connection.fileno()
+        wake_fd = self._wake_pipe[0]
+        return lambda: fd in select.select([fd, wake_fd], [], [])[0]
+    
+    def _handle_received(self, data):
+        # Строка может прийти по частям: незавершенный хвост ждет следующего чтения
+        buffer = self._rx_tail + data
+        cut = buffer.rfind(b"\n") + 1
+        complete, self._rx_tail = buffer[:cut], buffer[cut:]
+        if not complete:
+            return
+        
+        # Ответы "ok"/"error:" освобождают место в буфере устройства; считаем их
+        # прямо в байтах по началу строки, без разбора каждой строки в Python
+        framed = b"\n" + complete
+        acks = framed.count(b"\nok") + framed.count(b"\nerror")
+        
+        received = [text for text in (line.strip() for line in complete.decode('utf-8', errors='ignore').split("\n")) if text]
+        if not received:
+            return
+        
+        if acks:
+            with self._ack_cond:
+                self._ack_count += acks
+                self._acks_seen = True
+                self._ack_cond.notify_all()
+        
+        if self.detected_firmware is None:
+            self._detect_firmware(received)
+        
+        timestamp = time.strftime("%H:%M:%S")
+        with self.receive_lock:
+            self.receive_queue.extend(f"[{timestamp}] {text}" for text in received)
+        
+        decoded_data = "\n".join(received)
+        self.update_gui_status(decoded_data, True)
+        self.logger.info(f"Получено: {decoded_data}")
+    
+    def _detect_firmware(self, received):
+        # Приветствие прочитано на текущей скорости - значит, она рабочая для этого порта;
+        # прошивка не меняет скорость на ходу, поэтому другую скорость не предлагаем
+        for text in received:
+            for firmware in self.FIRMWARE_NAMES:
+                if firmware in text:
+                    self.detected_firmware = firmware
+                    self.port_baudrates[self.port_name] = self.baudrate
+                    self.logger.info(f"Обнаружена прошивка {firmware} на скорости {self.baudrate}")
+                    return
+    
+    def preferred_baudrate(self, port_name):
+        return self.port_baudrates.get(port_name, self.DEFAULT_BAUDRATE)
     
     def send_gcode(self, gcode_lines):
         if not self.is_connected or not self.serial_connection:
@@ -165,88 +285,143 @@ class SerialConnection(Connection):
         
         self.stop_send.clear()
         
-        with self.send_lock:
-            self.send_queue = gcode_lines.copy()
-        
-        self.send_thread = threading.Thread(target=self._send_gcode_thread, daemon=True)
+        # Строки передаются отправителю через очередь по мере добавления, без копии списка;
+        # None отмечает конец программы
+        send_q = queue.SimpleQueue()
+        self.send_thread = threading.Thread(
+            target=self._send_gcode_thread, args=(send_q, len(gcode_lines)), daemon=True
+        )
         self.send_thread.start()
+        for line in gcode_lines:
+            send_q.put(line)
+        send_q.put(None)
         
         return True, "Отправка G-кода начата"
     
-    def _send_gcode_thread(self):
+    def _send_gcode_thread(self, send_q, total_lines):
+        # Одна передача за раз: следующая ждет, пока отправитель предыдущей закончит
+        with self.send_lock:
+            self._transmit(send_q, total_lines)
+    
+    def _transmit(self, send_q, total_lines):
         if not self.is_connected or not self.serial_connection:
             return
         
         try:
             self.update_gui_status("Начало отправки G-кода...", True)
             
-            init_commands = [
-                "M110 N0",
-                "G90",
-                "G21",
-            ]
+            with self._ack_cond:
+                self._ack_count = 0
+            self._send_error = None
+            in_flight = deque()
             
-            for cmd in init_commands:
-                if self.stop_send.is_set():
-                    self.logger.info("Отправка прервана (инициализация)")
-                    return
-                success, message = self._send_line(cmd + '\n')
-                if not success:
-                    self.logger.warning(f"Ошибка отправки инициализационной команды: {cmd}")
-                time.sleep(0.1)
-            
-            total_lines = len(self.send_queue)
-            sent_lines = 0
-            errors = 0
-            
-            with self.send_lock:
-                for i, line in enumerate(self.send_queue, 1):
-                    if self.stop_send.is_set():
-                        self.logger.info(f"Отправка прервана на строке {i}")
-                        self.update_gui_status(f"Отправка прервана на строке {i}/{total_lines}", False)
-                        break
-                    
-                    line = line.strip()
-                    
-                    if not line or line.startswith(';') or line.startswith('('):
-                        continue
-                    
-                    success, message = self._send_line(line + '\n')
-                    
-                    if not success:
-                        errors += 1
-                        self.logger.error(f"Ошибка отправки строки {i}: {line}")
-                    
-                    if i % 5 == 0:
-                        progress = f"Отправлено: {i}/{total_lines} строк"
-                        self.update_gui_status(progress, True)
-                    
-                    time.sleep(0.03)
-                    sent_lines += 1
+            _, init_errors, _ = self._stream_lines(enumerate(_INIT_COMMANDS, 1), in_flight)
+            if self.stop_send.is_set():
+                self.logger.info("Отправка прервана (инициализация)")
+                if self._send_error:
+                    self.update_gui_status(f"Отправка прервана: {self._send_error}", False)
+                return
+            if init_errors:
+                self.logger.warning(f"Ошибка отправки инициализационных команд: {init_errors}")
+            
+            sent_lines, errors, stopped_at = self._stream_lines(
+                self._program_lines(iter(send_q.get, None)), in_flight, total_lines
+            )
+            if stopped_at:
+                self.logger.info(f"Отправка прервана на строке {stopped_at}")
+                self.update_gui_status(f"Отправка прервана на строке {stopped_at}/{total_lines}", False)
             
             if not self.stop_send.is_set():
-                end_commands = [
-                    "G0 X0 Y0 F1500",
-                    "M30"
-                ]
-                
-                for cmd in end_commands:
-                    success, message = self._send_line(cmd + '\n')
-                    if not success:
-                        self.logger.warning(f"Ошибка отправки завершающей команды: {cmd}")
-                    time.sleep(0.1)
+                _, end_errors, _ = self._stream_lines(enumerate(_END_COMMANDS, 1), in_flight)
+                if end_errors:
+                    self.logger.warning(f"Ошибка отправки завершающих команд: {end_errors}")
+                # Итог сообщается только после того, как M30 действительно ушел в порт
+                self.serial_connection.flush()
             
             result_msg = f"Отправлено {sent_lines} строк, ошибок: {errors}"
             if self.stop_send.is_set():
                 result_msg += " (ПРЕРВАНО)"
+            if self._send_error:
+                result_msg += f": {self._send_error}"
             self.logger.info(result_msg)
-            self.update_gui_status(result_msg, errors == 0)
+            self.update_gui_status(result_msg, errors == 0 and not self._send_error)
             
         except Exception as e:
             error_msg = f"Ошибка отправки G-кода: {str(e)}"
             self.logger.exception(error_msg)
             self.update_gui_status(error_msg, False)
     
+    def _stream_lines(self, numbered_lines, in_flight, total_lines=None):
+        # Потоковая отправка с подсчетом символов (как у GRBL): в буфере устройства держится
+        # не больше SEND_CHUNK_BYTES байт, каждый ответ "ok" освобождает место самой старой строки
+        sent = errors = 0
+        batch = []
+        batch_size = 0
+        
+        for number, line in numbered_lines:
+            if self.stop_send.is_set():
+                return sent, errors, batch[0][0] if batch else number
+            
+            size = len(line.encode('utf-8')) + 1
+            if batch and sum(in_flight) + batch_size + size > self.SEND_CHUNK_BYTES:
+                ok = self._write_batch(batch, in_flight, total_lines)
+                sent += ok
+                errors += len(batch) - ok
+                batch = []
+                batch_size = 0
+            self._wait_for_room(in_flight, size)
+            
+            batch.append((number, line, size))
+            batch_size += size
+        
+        if batch:
+            if self.stop_send.is_set():
+                return sent, errors, batch[0][0]
+            ok = self._write_batch(batch, in_flight, total_lines)
+            sent += ok
+            errors += len(batch) - ok
+        return sent, errors, None
+    
+    def _write_batch(self, batch, in_flight, total_lines):
+        first, last = batch[0][0], batch[-1][0]
+        success, message = self._send_line(''.join(line + '\n' for _, line, _ in batch))
+        if not success:
+            self.logger.error(f"Ошибка отправки строк {first}-{last}")
+            return 0
+        
+        in_flight.extend(size for _, _, size in batch)
+        if total_lines and last // 5 != (first - 1) // 5:
+            self.update_gui_status(f"Отправлено: {last}/{total_lines} строк", True)
+        return len(batch)
+    
+    def _wait_for_room(self, in_flight, size):
+        deadline = time.monotonic() + self.ACK_TIMEOUT_SECONDS
+        while in_flight and sum(in_flight) + size > self.SEND_CHUNK_BYTES:
+            if self.stop_send.is_set():
+                return
+            if not (self.receive_thread and self.receive_thread.is_alive()):
+                # Приемник завершился (например, устройство отключено) - ответов уже не будет
+                self._abort_send("прием данных от устройства остановлен")
+                return
+            with self._ack_cond:
+                self._ack_cond.wait_for(lambda: self._ack_count > 0, timeout=self.ACK_WAIT_SECONDS)
+                acks, self._ack_count = self._ack_count, 0
+            if acks:
+                for _ in range(min(acks, len(in_flight))):
+                    in_flight.popleft()
+                deadline = time.monotonic() + self.ACK_TIMEOUT_SECONDS
+            elif not self._acks_seen:
+                # Устройство без ответов: строка считается принятой после прежней паузы
+                in_flight.popleft()
+            elif time.monotonic() >= deadline:
+                self._abort_send(f"нет ответа \"ok\" от устройства {self.ACK_TIMEOUT_SECONDS:.0f} с")
+                return
+    
+    def _abort_send(self, reason):
+        self._send_error = reason
+        self.logger.error(f"Отправка прервана: {reason}")
+        self.stop_send.set()
+    
     def _send_line(self, line):
         if not self.is_connected or not self.serial_connection:
             return False, "Нет подключения"
@@ -255,9 +430,10 @@ class SerialConnection(Connection):
             return False, "Отправка прервана"
         
         try:
+            # Без flush: запись уходит в буфер ОС, и USB-драйвер объединяет пакеты сам
             self.serial_connection.write(line.encode('utf-8'))
-            self.serial_connection.flush()
-            self.logger.debug(f"Отправлено: {line.strip()}")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Отправлено: %s", line.strip())
             return True, "Данные отправлены"
         except serial.SerialTimeoutException as e:
             error_msg = f"Таймаут отправки: {str(e)}"
@@ -269,8 +445,10 @@ class SerialConnection(Connection):
             return False, error_msg
     
     def get_received_data(self):
-        if self.receive_queue:
-            return "\n".join(self.receive_queue)
+        with self.receive_lock:
+            received = list(self.receive_queue)
+        if received:
+            return "\n".join(received)
         return ""
     
     def emergency_stop(self):
@@ -280,22 +458,10 @@ class SerialConnection(Connection):
         try:
             self.stop_send.set()
             
-            emergency_commands = [
-                '\x18',  
-                '!',     
-                'M112',  
-                'M0',   
-                'M5',   
-                'M999', 
-            ]
-            
             success_count = 0
-            for cmd in emergency_commands:
+            for cmd in _EMERGENCY_BYTES:
                 try:
-                    if cmd == '\x18':
-                        self.serial_connection.write(b'\x18')
-                    else:
-                        self.serial_connection.write((cmd + '\n').encode('utf-8'))
+                    self.serial_connection.write(cmd)
                     self.serial_connection.flush()
                     success_count += 1
                     time.sleep(0.01)
@@ -309,12 +475,12 @@ class SerialConnection(Connection):
             except:
                 pass
             
-            status_msg = f"Экстренная остановка отправлена ({success_count}/6 команд)"
+            status_msg = f"Экстренная остановка отправлена ({success_count}/{len(_EMERGENCY_BYTES)} команд)"
             self.logger.warning(status_msg)
             self.update_gui_status("ЭКСТРЕННАЯ ОСТАНОВКА! Устройство должно остановиться", False)
             
             if hasattr(self.gui_app, 'emergency_stop_activated'):
-                self.gui_app.root.after(0, lambda: setattr(self.gui_app, 'emergency_stop_activated', True))
+                self.gui_app.root.after(0, setattr, self.gui_app, 'emergency_stop_activated', True)
             
             return True, status_msg
             
@@ -324,14 +490,25 @@ class SerialConnection(Connection):
             return False, error
 
 class BluetoothConnection(Connection):
+    # Полезная нагрузка одной записи при MTU по умолчанию (23 байта)
+    MIN_WRITE_SIZE = 20
+    # Результат сканирования (5 с эфира) переиспользуется при повторном обновлении и подключении
+    SCAN_CACHE_SECONDS = 10.0
+    
     def __init__(self, gui_app=None):
         super().__init__(gui_app)
         self.client = None
         self.device_address = None
         self.characteristic_uuid = None
+        self.write_size = self.MIN_WRITE_SIZE
         self.stop_send = asyncio.Event()
+        self._scan_cache = (0.0, [])
     
     async def get_available_devices(self):
+        cached_at, cached_devices = self._scan_cache
+        if cached_devices and time.monotonic() - cached_at < self.SCAN_CACHE_SECONDS:
+            return list(cached_devices)
+        
         try:
             self.logger.info("Сканирование Bluetooth устройств...")
             devices = await BleakScanner.discover(timeout=5.0)
@@ -356,7 +533,8 @@ class BluetoothConnection(Connection):
                 } for device in devices]
             
             self.logger.info(f"Найдено Bluetooth устройств: {len(cnc_devices)}")
-            return cnc_devices
+            self._scan_cache = (time.monotonic(), cnc_devices)
+            return list(cnc_devices)
             
         except Exception as e:
             self.logger.error(f"Ошибка сканирования Bluetooth: {str(e)}")
@@ -385,11 +563,13 @@ class BluetoothConnection(Connection):
                 self.update_gui_status("Bluetooth подключение установлено", True)
                 return True, status_msg
             else:
+                self._scan_cache = (0.0, [])
                 error_msg = f"Не удалось подключиться к {device_address}"
                 self.logger.error(error_msg)
                 return False, error_msg
                 
         except Exception as e:
+            self._scan_cache = (0.0, [])
             error_msg = f"Ошибка Bluetooth подключения: {str(e)}"
             self.logger.exception(error_msg)
             self.update_gui_status(error_msg, False)
@@ -412,6 +592,7 @@ class BluetoothConnection(Connection):
                     char_uuid_lower = char.uuid.lower()
                     if 'write' in char.properties and any(std_uuid in char_uuid_lower for std_uuid in standard_uuids):
                         self.logger.info(f"Найдена стандартная характеристика для записи: {char.uuid}")
+                        self._set_write_size(char)
                         return char.uuid
             
             for service in self.client.services:
@@ -419,6 +600,7 @@ class BluetoothConnection(Connection):
                     properties = [prop.lower() for prop in char.properties]
                     if 'write' in properties or 'write-without-response' in properties:
                         self.logger.info(f"Используется первая доступная характеристика для записи: {char.uuid}")
+                        self._set_write_size(char)
                         return char.uuid
             
             self.logger.warning("Не найдено характеристик для записи")
@@ -428,6 +610,32 @@ class BluetoothConnection(Connection):
             self.logger.error(f"Ошибка поиска характеристики: {str(e)}")
             return None
     
+    def _set_write_size(self, char):
+        # Размер записи без ответа определяется согласованным MTU
+        self.write_size = max(self.MIN_WRITE_SIZE, getattr(char, 'max_write_without_response_size', 0))
+    
+    def _pack_lines(self, numbered_lines):
+        # Строки складываются в пакеты размером с одну запись GATT; длинная строка режется на части
+        size = self.write_size
+        packet = bytearray()
+        first = last = count = 0
+        for number, line in numbered_lines:
+            data = (line + '\n').encode('utf-8')
+            if packet and len(packet) + len(data) > size:
+                yield first, last, count, bytes(packet)
+                packet = bytearray()
+                count = 0
+            if not packet:
+                first = number
+            while len(data) > size:
+                yield number, number, 0, data[:size]
+                data = data[size:]
+            packet += data
+            last = number
+            count += 1
+        if packet:
+            yield first, last, count, bytes(packet)
+    
     async def disconnect(self):
         try:
             self.stop_send.set()
@@ -443,6 +651,7 @@ class BluetoothConnection(Connection):
         self.client = None
         self.device_address = None
         self.characteristic_uuid = None
+        self.write_size = self.MIN_WRITE_SIZE
         self.stop_send.clear()
         
         if prev_connected:
@@ -463,56 +672,41 @@ class BluetoothConnection(Connection):
             
             self.update_gui_status("Начало отправки G-кода через Bluetooth...", True)
             
-            init_commands = [
-                "M110 N0\n",
-                "G90\n",
-                "G21\n",
-            ]
-            
-            for cmd in init_commands:
+            for cmd in _INIT_BYTES:
                 if self.stop_send.is_set():
                     return False, "Отправка прервана экстренной остановкой"
                 success, message = await self._send_line(cmd)
                 if not success:
-                    self.logger.warning(f"Ошибка отправки инициализационной команды: {cmd}")
+                    self.logger.warning(f"Ошибка отправки инициализационной команды: {cmd.decode('utf-8').strip()}")
                 await asyncio.sleep(0.1)
             
             total_lines = len(gcode_lines)
             sent_lines = 0
             errors = 0
             
-            for i, line in enumerate(gcode_lines, 1):
+            for first, last, count, packet in self._pack_lines(self._program_lines(gcode_lines)):
                 if self.stop_send.is_set():
                     return False, "Отправка прервана экстренной остановкой"
                 
-                line = line.strip()
-                
-                if not line or line.startswith(';') or line.startswith('('):
-                    continue
-                
-                success, message = await self._send_line(line + '\n')
+                success, message = await self._send_line(packet)
                 
                 if not success:
-                    errors += 1
-                    self.logger.error(f"Ошибка отправки строки {i}: {line}")
+                    errors += count
+                    self.logger.error(f"Ошибка отправки строк {first}-{last}")
                 
-                if i % 5 == 0:
-                    progress = f"Bluetooth: Отправлено {i}/{total_lines} строк"
+                if last // 5 != (first - 1) // 5:
+                    progress = f"Bluetooth: Отправлено {last}/{total_lines} строк"
                     self.update_gui_status(progress, True)
                 
-                await asyncio.sleep(0.05)
-                sent_lines += 1
+                # Подтверждений по BLE нет: темп прежний в пересчете на строку, чтобы не переполнить буфер
+                await asyncio.sleep(0.05 * count)
+                sent_lines += count
             
             if not self.stop_send.is_set():
-                end_commands = [
-                    "G0 X0 Y0 F1500\n",
-                    "M30\n"
-                ]
-                
-                for cmd in end_commands:
+                for cmd in _END_BYTES:
                     success, message = await self._send_line(cmd)
                     if not success:
-                        self.logger.warning(f"Ошибка отправки завершающей команды: {cmd}")
+                        self.logger.warning(f"Ошибка отправки завершающей команды: {cmd.decode('utf-8').strip()}")
                     await asyncio.sleep(0.1)
             
             result_msg = f"Отправлено {sent_lines} строк через Bluetooth, ошибок: {errors}"
@@ -536,8 +730,10 @@ class BluetoothConnection(Connection):
             return False, "Отправка прервана"
         
         try:
-            await self.client.write_gatt_char(self.characteristic_uuid, line.encode('utf-8'), response=False)
-            self.logger.debug(f"Bluetooth отправлено: {line.strip()}")
+            data = line if isinstance(line, bytes) else line.encode('utf-8')
+            await self.client.write_gatt_char(self.characteristic_uuid, data, response=False)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Bluetooth отправлено: %s", data.decode('utf-8', errors='ignore').strip())
             return True, "Данные отправлены"
         except Exception as e:
             error_msg = f"Ошибка Bluetooth отправки: {str(e)}"
@@ -552,29 +748,23 @@ class BluetoothConnection(Connection):
         
         self.stop_send.set()
         
-        emergency_commands = [
-            "M112\n",
-            "!\n",
-            "\x18",
-            "M5\n",
-        ]
-        
+        # Все команды (11 байт) должны помещаться в MIN_WRITE_SIZE (20 байт при MTU по умолчанию):
+        # тогда они уходят одной записью без ответа в ближайший интервал соединения и в нужном порядке;
+        # пишем напрямую, т.к. _send_line отбрасывает данные после stop_send
         success_count = 0
-        for cmd in emergency_commands:
-            try:
-                success, _ = await self._send_line(cmd)
-                if success:
-                    success_count += 1
-                await asyncio.sleep(0.01)
-            except:
-                pass
+        try:
+            packet = b"".join(_BLE_EMERGENCY_BYTES)
+            await self.client.write_gatt_char(self.characteristic_uuid, packet, response=False)
+            success_count = len(_BLE_EMERGENCY_BYTES)
+        except Exception as e:
+            self.logger.error(f"Ошибка Bluetooth отправки: {str(e)}")
         
-        status_msg = f"Bluetooth: Экстренная остановка отправлена ({success_count}/{len(emergency_commands)} команд)"
+        status_msg = f"Bluetooth: Экстренная остановка отправлена ({success_count}/{len(_BLE_EMERGENCY_BYTES)} команд)"
         self.logger.warning(status_msg)
         self.update_gui_status("ЭКСТРЕННАЯ ОСТАНОВКА (Bluetooth) АКТИВИРОВАНА!", False)
         
         if hasattr(self.gui_app, 'emergency_stop_activated'):
-            self.gui_app.root.after(0, lambda: setattr(self.gui_app, 'emergency_stop_activated', True))
+            self.gui_app.root.after(0, setattr, self.gui_app, 'emergency_stop_activated', True)
         
         return success_count > 0, status_msg
 
@@ -586,6 +776,28 @@ class ConnectionManager:
         self.bluetooth_conn = BluetoothConnection(gui_app)
         self.is_connected = False
         self.last_received = ""
+        self._bt_loop = None
+        self._bt_loop_lock = threading.Lock()
+    
+    def _run_bluetooth(self, coro):
+        # Все вызовы Bleak идут в одном постоянном цикле событий в фоновом потоке:
+        # клиент и его обработчики живут между вызовами, цикл не создается заново
+        # Вызывается и из GUI (экстренная остановка), и из рабочего потока отправки:
+        # под блокировкой создается ровно один цикл
+        with self._bt_loop_lock:
+            if self._bt_loop is None:
+                self._bt_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._bt_loop.run_forever, daemon=True).start()
+            loop = self._bt_loop
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    
+    def close(self):
+        if self.is_connected:
+            self.disconnect()
+        with self._bt_loop_lock:
+            if self._bt_loop is not None:
+                self._bt_loop.call_soon_threadsafe(self._bt_loop.stop)
+                self._bt_loop = None
     
     def get_available_devices(self, connection_type="serial"):
         try:
@@ -594,14 +806,14 @@ class ConnectionManager:
                 home_dir = os.path.expanduser('~')
                 return devices
             elif connection_type == "bluetooth" and self.bluetooth_conn:
-                return asyncio.run(self.bluetooth_conn.get_available_devices())
+                return self._run_bluetooth(self.bluetooth_conn.get_available_devices())
             return []
         except Exception as e:
             error_msg = f"Ошибка получения доступных устройств: {str(e)}"
             logging.error(error_msg)
             return []
     
-    def connect(self, device_id, connection_type="serial"):
+    def connect(self, device_id, connection_type="serial", baudrate=SerialConnection.DEFAULT_BAUDRATE):
         try:
             if self.is_connected:
                 self.disconnect()
@@ -609,11 +821,11 @@ class ConnectionManager:
             self.connection_type = connection_type
             
             if connection_type == "serial":
-                success, message = self.serial_conn.connect(device_id)
+                success, message = self.serial_conn.connect(device_id, baudrate)
                 self.is_connected = success
                 return success, message
             elif connection_type == "bluetooth" and self.bluetooth_conn:
-                success, message = asyncio.run(self.bluetooth_conn.connect(device_id))
+                success, message = self._run_bluetooth(self.bluetooth_conn.connect(device_id))
                 self.is_connected = success
                 return success, message
             
@@ -629,7 +841,7 @@ class ConnectionManager:
             if self.connection_type == "serial":
                 return self.serial_conn.disconnect()
             elif self.connection_type == "bluetooth" and self.bluetooth_conn:
-                return asyncio.run(self.bluetooth_conn.disconnect())
+                return self._run_bluetooth(self.bluetooth_conn.disconnect())
             
             return False, "Нет активного подключения"
             
@@ -646,7 +858,7 @@ class ConnectionManager:
             if self.connection_type == "serial":
                 return self.serial_conn.send_gcode(gcode_lines)
             elif self.connection_type == "bluetooth" and self.bluetooth_conn:
-                return asyncio.run(self.bluetooth_conn.send_gcode(gcode_lines))
+                return self._run_bluetooth(self.bluetooth_conn.send_gcode(gcode_lines))
             
             return False, "Неподдерживаемый тип подключения"
             
@@ -666,7 +878,7 @@ class ConnectionManager:
                 
                 return self.serial_conn.emergency_stop()
             elif self.connection_type == "bluetooth" and self.bluetooth_conn:
-                return asyncio.run(self.bluetooth_conn.emergency_stop())
+                return self._run_bluetooth(self.bluetooth_conn.emergency_stop())
             
             return False, "Неподдерживаемый тип подключения"
             
@@ -1,5 +1,5 @@
 from PIL import Image, ImageTk
-import math
+import cv2
 import numpy as np
 from config import DEFAULT_CONFIG
 
@@ -15,25 +15,45 @@ def display_image_on_canvas(image, canvas):
     new_width = int(img_width * ratio)
     new_height = int(img_height * ratio)
     
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    photo = ImageTk.PhotoImage(resized_image)
+    if (new_width, new_height) == image.size:
+        resized_image = image
+    else:
+        resized_image = resize_image(image, (new_width, new_height))
+    photo = getattr(canvas, "image", None)
     
-    canvas.delete("all")
-    canvas.create_image(canvas_width // 2, canvas_height // 2, image=photo)
-    canvas.image = photo
+    if (photo is not None and (photo.width(), photo.height()) == resized_image.size
+            and canvas.image_mode == resized_image.mode):
+        photo.paste(resized_image)
+    else:
+        photo = ImageTk.PhotoImage(resized_image)
+        canvas.image = photo
+        canvas.image_mode = resized_image.mode
+        
+    if canvas.find_withtag("image"):
+        canvas.itemconfigure("image", image=photo)
+        canvas.coords("image", canvas_width // 2, canvas_height // 2)
+    else:
+        canvas.delete("all")
+        canvas.create_image(canvas_width // 2, canvas_height // 2, image=photo, tags="image")
     return photo
 
+def resize_image(image, size):
+    # OpenCV масштабирует RGB/L заметно быстрее PIL; остальные режимы остаются на PIL
+    if image.mode not in ("RGB", "RGBA", "L"):
+        return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    interpolation = cv2.INTER_AREA if size[0] < image.width else cv2.INTER_LANCZOS4
+    resized = cv2.resize(np.asarray(image), size, interpolation=interpolation)
+    # L и RGBA PIL отображает прямо на буфер OpenCV без копии; RGB хранится по 4 байта
+    # на пиксель, поэтому для него frombuffer все равно копирует
+    return Image.frombuffer(image.mode, size, resized, "raw", image.mode, 0, 1)
+
 def auto_adjust_scale(image, config):
     width, height = image.size
-    max_dimension = max(width, height)
     
     work_area_x = config.get("work_area_x", DEFAULT_CONFIG["work_area_x"])
     work_area_y = config.get("work_area_y", DEFAULT_CONFIG["work_area_y"])
     
-    scale_x = work_area_x / width * 0.9
-    scale_y = work_area_y / height * 0.9
-    
-    config["scale_factor"] = min(scale_x, scale_y, 0.3)
+    config["scale_factor"] = min(min(work_area_x / width, work_area_y / height) * 0.9, 0.3)
     return config["scale_factor"]
 
 def transform_coordinates(x, y, image_width, image_height, scale_factor, work_area_x, work_area_y):
@@ -53,6 +73,21 @@ def transform_coordinates(x, y, image_width, image_height, scale_factor, work_ar
     
     return x_final, y_final
 
+def transform_coordinates_batch(points, image_width, image_height, scale_factor, work_area_x, work_area_y):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    
+    x_offset = (work_area_x - (image_width * scale_factor)) / 2
+    y_offset = (work_area_y - (image_height * scale_factor)) / 2
+    
+    result = np.empty_like(points)
+    result[:, 0] = points[:, 0] * scale_factor + x_offset
+    result[:, 1] = (image_height - points[:, 1]) * scale_factor + y_offset
+    
+    np.clip(result[:, 0], 0, work_area_x, out=result[:, 0])
+    np.clip(result[:, 1], 0, work_area_y, out=result[:, 1])
+    
+    return result
+
 def calculate_safe_z(pen_up_z, safety_margin=5.0):
     return max(pen_up_z, safety_margin)
 